@@ -0,0 +1,87 @@
+"""Benchmark of the JSON encoders on real API payloads.
+
+Seeds a throwaway SQLite database, builds the payloads the list endpoints
+return (orphanages with totals, users, messages, donations), then times
+Flask's stdlib encoder against FastJSONEncoder (orjson) on each of them.
+Both outputs must be identical, the script exits with 1 otherwise.
+
+    python benchmarks/json_encoders.py --items 100 --repeat 200
+"""
+from time import perf_counter
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKDIR = tempfile.mkdtemp(prefix='orph-json-')
+# The app reads its config from the environment when config.py is imported
+os.environ.update({
+    'DATABASE_URL': 'sqlite:///' + os.path.join(WORKDIR, 'bench.db'),
+    'UPLOAD_FOLDER': os.path.join(WORKDIR, 'images'),
+    'RESPONSE_CACHE_PATH': '',
+})
+sys.path.insert(0, ROOT)
+# Keeps the app's logs/ folder out of the repo
+os.chdir(WORKDIR)
+
+from flask import json as flask_json
+from flask.json import JSONEncoder
+from setup import create_app, db
+from setup.encoder import FastJSONEncoder, orjson
+from setup.models import Donation, Message, Orphanage, User
+from setup.seed import seed
+
+
+def payloads(items):
+    # name -> payload, shaped like the responses of the list endpoints
+    return {
+        'orphanages': {'items': [o.to_dict(include_totals=True) for o in Orphanage.query.limit(items)]},
+        'users': {'items': [u.to_dict(include_totals=True) for u in User.query.limit(items)]},
+        'messages': {'items': [m.to_dict() for m in Message.query.limit(items)]},
+        'donations': {'items': [d.to_dict() for d in Donation.query.limit(items)]},
+    }
+
+
+def timed(encoder, payload, repeat):
+    # Seconds per jsonify-style dumps (compact, sorted keys, as in production)
+    start = perf_counter()
+    for _ in range(repeat):
+        flask_json.dumps(payload, cls=encoder, separators=(',', ':'))
+    return (perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--items', type=int, default=100, help='items per payload')
+    parser.add_argument('--repeat', type=int, default=200, help='encodings timed per payload and encoder')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    args = parser.parse_args()
+    if orjson is None:
+        sys.exit('orjson is not installed, FastJSONEncoder would only use the stdlib encoder')
+
+    app = create_app()
+    results = {}
+    with app.test_request_context():
+        db.create_all()
+        seed(users=args.items, orphanages=args.items, messages=args.items, donations=args.items * 10)
+        failed = False
+        for name, payload in payloads(args.items).items():
+            stdlib = flask_json.dumps(payload, cls=JSONEncoder, separators=(',', ':'))
+            fast = flask_json.dumps(payload, cls=FastJSONEncoder, separators=(',', ':'))
+            if stdlib != fast:
+                print(f'{name}: the encoders disagree', file=sys.stderr)
+                failed = True
+            stdlib_time, fast_time = timed(JSONEncoder, payload, args.repeat), timed(FastJSONEncoder, payload, args.repeat)
+            results[name] = {'bytes': len(fast.encode('utf-8')), 'stdlib_ms': round(stdlib_time * 1000, 3),
+                             'orjson_ms': round(fast_time * 1000, 3), 'speedup': round(stdlib_time / fast_time, 1)}
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
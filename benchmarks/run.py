@@ -0,0 +1,254 @@
+"""HTTP benchmark of the API endpoints.
+
+Seeds a throwaway SQLite database, then drives every endpoint through the
+Flask test client and/or a real gunicorn process and reports p50/p95/p99
+latency, throughput and SQL statements per request as JSON. With --baseline
+the numbers are compared to a stored run and the script exits with 1 when
+one of them regressed by more than --tolerance.
+
+    python benchmarks/run.py --mode both --output bench_results.json
+    python benchmarks/run.py --save-baseline benchmarks/baseline.json
+    python benchmarks/run.py --baseline benchmarks/baseline.json
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from time import perf_counter, sleep
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import zlib
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Paths given on the command line are relative to where the script was started
+CWD = os.getcwd()
+WORKDIR = tempfile.mkdtemp(prefix='orph-bench-')
+# The app reads its config from the environment when config.py is imported
+os.environ.update({
+    'DATABASE_URL': 'sqlite:///' + os.path.join(WORKDIR, 'bench.db'),
+    'UPLOAD_FOLDER': os.path.join(WORKDIR, 'images'),
+    'RESPONSE_CACHE_PATH': os.path.join(WORKDIR, 'response_cache.db'),
+    'PROMETHEUS_MULTIPROC_DIR': os.path.join(WORKDIR, 'prometheus'),
+    'LOG_REQUEST_SAMPLE_RATE': '0',
+})
+os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'])
+sys.path.insert(0, ROOT)
+# Keeps the app's logs/ folder out of the repo
+os.chdir(WORKDIR)
+
+from sqlalchemy import event
+from setup import create_app, db
+from setup.seed import seed, SEED_PASSWORD as PASSWORD
+
+
+def tiny_png():
+    # A valid 1x1 PNG, enough for the upload endpoint
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', 1, 1, 8, 2, 0, 0, 0)) + \
+        chunk(b'IDAT', zlib.compress(b'\x00\xff\x00\x00')) + chunk(b'IEND', b'')
+
+
+def scenarios(orphanages, rng):
+    # name -> function returning the keyword arguments of one request
+    png = tiny_png()
+    return {
+        'tokens': lambda: dict(method='POST', path='/api/tokens', json={'username': 'user1', 'password': PASSWORD}),
+        'users': lambda: dict(method='GET', path='/api/users', auth=True),
+        'orphanages': lambda: dict(method='GET', path='/api/orphanages'),
+        'orphanage': lambda: dict(method='GET', path=f'/api/orphanage/{rng.randint(1, orphanages)}'),
+        'donations': lambda: dict(method='POST', path='/api/donations', json={
+            'username': 'user1', 'orphanage_name': f'Orphanage {rng.randint(0, orphanages - 1)}', 'amount': 10}),
+        'orphanage_donations': lambda: dict(method='GET', auth=True,
+                                            path=f'/api/orphanage_donations/{rng.randint(1, orphanages)}'),
+        'messages': lambda: dict(method='GET', path='/api/messages'),
+        'image_upload': lambda: dict(method='POST', path='/api/image_upload', files={'file': ('bench.png', png)}),
+    }
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def summarize(latencies, elapsed, errors, queries):
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'throughput_rps': round(len(latencies) / elapsed, 1),
+        'queries_per_request': round(queries, 2) if queries is not None else None,
+    }
+
+
+def run_test_client(app, requests, orphanages, rng):
+    client = app.test_client()
+    token = client.post('/api/tokens', json={'username': 'user0', 'password': PASSWORD}).get_json()['token']
+    statements = []
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', lambda *args: statements.append(1))
+    results = {}
+    for name, make_request in scenarios(orphanages, rng).items():
+        latencies, errors = [], 0
+        statements.clear()
+        started = perf_counter()
+        for _ in range(requests):
+            kwargs = make_request()
+            headers = {'Authorization': 'Bearer ' + token} if kwargs.pop('auth', False) else {}
+            files = kwargs.pop('files', None)
+            if files:
+                kwargs['data'] = {key: (io.BytesIO(data), filename)
+                                  for key, (filename, data) in files.items()}
+            start = perf_counter()
+            response = client.open(kwargs.pop('path'), headers=headers, **kwargs)
+            latencies.append(perf_counter() - start)
+            errors += response.status_code >= 400
+        results[name] = summarize(latencies, perf_counter() - started, errors, len(statements) / requests)
+    return results
+
+
+def run_gunicorn(requests, orphanages, rng, workers, concurrency, port):
+    import requests as http
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-w', str(workers), '-b', f'127.0.0.1:{port}',
+                               '--pythonpath', ROOT, 'orph:application'],
+                              cwd=WORKDIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base = f'http://127.0.0.1:{port}'
+    try:
+        for _ in range(100):
+            try:
+                http.get(base + '/api/messages', timeout=5)
+                break
+            except http.RequestException:
+                sleep(0.2)
+        token = http.post(base + '/api/tokens', json={'username': 'user0', 'password': PASSWORD}).json()['token']
+        sessions = {}
+
+        def send(kwargs):
+            session = sessions.setdefault(threading.get_ident(), http.Session())
+            headers = {'Authorization': 'Bearer ' + token} if kwargs.pop('auth', False) else {}
+            start = perf_counter()
+            response = session.request(kwargs.pop('method'), base + kwargs.pop('path'), headers=headers, **kwargs)
+            return perf_counter() - start, response.status_code >= 400
+
+        results = {}
+        with ThreadPoolExecutor(concurrency) as pool:
+            for name, make_request in scenarios(orphanages, rng).items():
+                batch = [make_request() for _ in range(requests)]
+                started = perf_counter()
+                outcomes = list(pool.map(send, batch))
+                elapsed = perf_counter() - started
+                results[name] = summarize([latency for latency, _ in outcomes], elapsed,
+                                          sum(error for _, error in outcomes), None)
+        # SQL statements per request, from the metrics all the workers share
+        metrics = http.get(base + '/api/metrics').text
+        for name, stats in results.items():
+            stats['queries_per_request'] = queries_from_metrics(metrics, name)
+        return results
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def queries_from_metrics(metrics, scenario):
+    endpoints = {'tokens': 'api.get_token', 'users': 'api.get_users', 'orphanages': 'api.get_orphanages',
+                 'orphanage': 'api.get_orphanage', 'donations': 'api.add_donation',
+                 'orphanage_donations': 'api.get_donations', 'messages': 'api.get_messages',
+                 'image_upload': 'api.image_upload'}
+    values = {}
+    for line in metrics.splitlines():
+        for suffix in ['sum', 'count']:
+            if line.startswith(f'api_request_db_queries_{suffix}{{endpoint="{endpoints[scenario]}"}}'):
+                values[suffix] = float(line.rsplit(' ', 1)[1])
+    if not values.get('count'):
+        return None
+    return round(values['sum'] / values['count'], 2)
+
+
+def compare(results, baseline, tolerance):
+    # Latencies may grow and throughput may drop by `tolerance` before it counts as a regression
+    regressions = []
+    for mode, scenario_results in results.items():
+        for name, stats in scenario_results.items():
+            reference = baseline.get('results', {}).get(mode, {}).get(name)
+            if not reference:
+                continue
+            for metric in ['p50_ms', 'p95_ms', 'p99_ms', 'queries_per_request']:
+                if reference.get(metric) and stats.get(metric) is not None and \
+                        stats[metric] > reference[metric] * (1 + tolerance):
+                    regressions.append(f'{mode}/{name} {metric}: {reference[metric]} -> {stats[metric]}')
+            if stats['throughput_rps'] < reference['throughput_rps'] * (1 - tolerance):
+                regressions.append(f"{mode}/{name} throughput_rps: {reference['throughput_rps']} -> "
+                                   f"{stats['throughput_rps']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', choices=['client', 'gunicorn', 'both'], default='client')
+    parser.add_argument('--requests', type=int, default=200, help='requests per endpoint')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--orphanages', type=int, default=200)
+    parser.add_argument('--donations', type=int, default=50000)
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn workers')
+    parser.add_argument('--concurrency', type=int, default=8, help='client threads in gunicorn mode')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--seed', type=int, default=42)
+    path = lambda value: os.path.join(CWD, value)
+    parser.add_argument('--output', type=path, default=os.path.join(WORKDIR, 'bench_results.json'),
+                        help='results file, in the temporary work directory by default')
+    parser.add_argument('--baseline', type=path, help='stored results to compare against')
+    parser.add_argument('--save-baseline', type=path, help='also write the results to this file')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        seed(args.users, args.orphanages, args.messages, args.donations, args.seed)
+    results = {}
+    if args.mode in ['client', 'both']:
+        results['client'] = run_test_client(app, args.requests, args.orphanages, rng)
+    if args.mode in ['gunicorn', 'both']:
+        results['gunicorn'] = run_gunicorn(args.requests, args.orphanages, rng, args.workers, args.concurrency,
+                                           args.port)
+    report = {
+        'meta': {
+            'date': datetime.utcnow().isoformat() + 'Z',
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'args': vars(args),
+        },
+        'results': results,
+    }
+    for path in filter(None, [args.output, args.save_baseline]):
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    for mode, scenario_results in results.items():
+        for name, stats in scenario_results.items():
+            print(f"{mode:9} {name:20} p50 {stats['p50_ms']:8.2f} ms  p95 {stats['p95_ms']:8.2f} ms  "
+                  f"p99 {stats['p99_ms']:8.2f} ms  {stats['throughput_rps']:8.1f} req/s  "
+                  f"{stats['queries_per_request']} queries/req  {stats['errors']} errors")
+    print('Results written to', args.output)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print('REGRESSION', regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
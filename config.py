@@ -1,4 +1,5 @@
 import os 
+import tempfile
 from dotenv import load_dotenv
 
 basedir = os.path.abspath(os.path.dirname(__file__))
@@ -19,10 +20,66 @@ class Config(object):
     MAIL_PASSWORD = os.environ.get("MAIL_PASSWORD")
     ADMINS = os.environ.get("ADMINS")
     LOG_TO_STDOUT = os.environ.get('LOG_TO_STDOUT')
+    # Config variables for the log pipeline
+    LOG_QUEUE_SIZE = 10000
+    LOG_MAX_BYTES = int(os.environ.get('LOG_MAX_BYTES') or 10 * 1024 * 1024)
+    LOG_FLUSH_INTERVAL = 1.0
+    MAIL_LOG_INTERVAL = int(os.environ.get('MAIL_LOG_INTERVAL') or 60)
+    # Share of the requests logged (one JSON line each, cut to LOG_REQUEST_MAX_CHARS)
+    LOG_REQUEST_SAMPLE_RATE = float(os.environ.get('LOG_REQUEST_SAMPLE_RATE') or 0.01)
+    LOG_REQUEST_MAX_CHARS = 1000
+    # Config variables for the SQL monitor (slow queries and N+1 detection)
+    SQL_MONITOR = os.environ.get('SQL_MONITOR') is not None
+    SLOW_QUERY_MS = int(os.environ.get('SLOW_QUERY_MS') or 200)
+    N_PLUS_ONE_THRESHOLD = int(os.environ.get('N_PLUS_ONE_THRESHOLD') or 10)
+    # Config variables for password hashing (werkzeug method and PBKDF2 iterations).
+    # Stored hashes using other parameters are upgraded at the next login.
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD') or 'pbkdf2:sha256'
+    PASSWORD_HASH_ITERATIONS = int(os.environ.get('PASSWORD_HASH_ITERATIONS') or 260000)
+    # Hashes run at once on the host (all the workers share the lock files in
+    # PASSWORD_HASH_SLOT_DIR), hashes allowed to wait per worker, and how long
+    # (in seconds) a request waits for a slot before getting a 503
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS') or 2)
+    PASSWORD_HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING') or 16)
+    PASSWORD_HASH_QUEUE_TIMEOUT = 1.0
+    PASSWORD_HASH_SLOT_DIR = os.environ.get('PASSWORD_HASH_SLOT_DIR')
+    # Largest radius (in km) accepted by /orphanages/nearby
+    NEARBY_MAX_RADIUS_KM = 500
+    # JSON responses are encoded by orjson when it's installed (JSON_ENCODER=stdlib
+    # turns it off). Non-ASCII characters are written as UTF-8, like orjson does.
+    JSON_ENCODER = os.environ.get('JSON_ENCODER') or 'orjson'
+    JSON_AS_ASCII = False
     # Config variable for pagination
     POSTS_PER_PAGE = 20
+    # Donations inserted per statement by the bulk donations endpoint
+    DONATION_BATCH_SIZE = 1000
+    # How long (in seconds) an Idempotency-Key is remembered
+    IDEMPOTENCY_KEY_TTL = int(os.environ.get('IDEMPOTENCY_KEY_TTL') or 24 * 3600)
     UPLOAD_FOLDER = os.environ.get("UPLOAD_FOLDER")
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg','gif'}
     MAX_CONTENT_LENGTH = 5000 * 1024 #500 KB
+    # Resized copies made of every uploaded image: name -> (max width/height, format or None to keep it)
+    IMAGE_VARIANTS = {'thumb': (320, None), 'medium': (1024, None), 'webp': (1024, 'webp')}
+    IMAGE_VARIANT_QUALITY = 80
+    IMAGE_VARIANT_WORKERS = int(os.environ.get('IMAGE_VARIANT_WORKERS') or 2)
+    # Uploaded images are cached by clients for IMAGE_MAX_AGE seconds. Behind a front
+    # server, IMAGE_SENDFILE ('x-sendfile' for Apache/lighttpd, 'x-accel-redirect' for
+    # nginx, with IMAGE_ACCEL_PREFIX an internal location aliased to UPLOAD_FOLDER)
+    # lets it send the bytes instead of the worker.
+    IMAGE_MAX_AGE = 365 * 24 * 3600
+    IMAGE_SENDFILE = os.environ.get('IMAGE_SENDFILE')
+    IMAGE_ACCEL_PREFIX = os.environ.get('IMAGE_ACCEL_PREFIX') or '/protected-images/'
+    # Config variables for the API token cache (TTL in seconds, 0 size disables it).
+    # It needs RESPONSE_CACHE_PATH, where its invalidations are shared between the
+    # workers, and is off without it. Users or tokens changed with raw SQL rather
+    # than the ORM are only seen once their cached entry is TOKEN_CACHE_TTL old.
+    TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE') or 1024)
+    TOKEN_CACHE_TTL = int(os.environ.get('TOKEN_CACHE_TTL') or 60)
+    # Config variables for the shared response cache (an empty path disables it, and
+    # the token cache with it). Its entries are keyed on the database, one file can
+    # serve several.
+    RESPONSE_CACHE_PATH = os.environ.get('RESPONSE_CACHE_PATH',
+                                         os.path.join(tempfile.gettempdir(), 'orph-response-cache.db'))
+    RESPONSE_CACHE_MAX_BYTES = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES') or 64 * 1024 * 1024)
 
 config = Config()
\ No newline at end of file
@@ -64,6 +64,12 @@ def run_migrations_online():
     # this callback is used to prevent an auto-migration from being generated
     # when there are no changes to the schema
     # reference: http://alembic.zzzcomputing.com/en/latest/cookbook.html
+    def include_object(object, name, type_, reflected, compare_to):
+        # The full-text search tables are managed by hand (see setup/search.py)
+        if type_ == 'table' and reflected and name.startswith('orphanage_fts'):
+            return False
+        return True
+
     def process_revision_directives(context, revision, directives):
         if getattr(config.cmd_opts, 'autogenerate', False):
             script = directives[0]
@@ -78,6 +84,7 @@ def run_migrations_online():
             connection=connection,
             target_metadata=target_metadata,
             process_revision_directives=process_revision_directives,
+            include_object=include_object,
             **current_app.extensions['migrate'].configure_args
         )
 
@@ -0,0 +1,42 @@
+"""Added orphanage search index
+
+Revision ID: 2a9e7c4f6b13
+Revises: 6f1d3b8e2c57
+Create Date: 2026-10-18 14:22:09.451870
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2a9e7c4f6b13'
+down_revision = '6f1d3b8e2c57'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Not autogenerated: the search index depends on the database. SQLite gets
+    # an FTS5 table filled from the existing rows, Postgres a GIN index on the
+    # same tsvector expression setup/search.py queries.
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        op.execute("CREATE VIRTUAL TABLE orphanage_fts USING fts5("
+                   "name, heading, story, activities, good_work, tokenize='porter unicode61')")
+        op.execute("INSERT INTO orphanage_fts (rowid, name, heading, story, activities, good_work) "
+                   "SELECT id, name, heading, story, activities, good_work FROM orphanage")
+    elif dialect == 'postgresql':
+        op.execute("CREATE INDEX ix_orphanage_search ON orphanage USING gin (("
+                   "setweight(to_tsvector('english', coalesce(name, '')), 'A') || "
+                   "setweight(to_tsvector('english', coalesce(heading, '')), 'B') || "
+                   "to_tsvector('english', coalesce(story, '') || ' ' || coalesce(activities, '') || ' ' || "
+                   "coalesce(good_work, ''))))")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        op.execute('DROP TABLE orphanage_fts')
+    elif dialect == 'postgresql':
+        op.execute('DROP INDEX ix_orphanage_search')
@@ -1,7 +1,12 @@
 from setup import create_app, db
-from setup.models import User, Orphanage, Message, Donation
+from setup.models import User, Orphanage, Message, Donation, IdempotencyKey
+from setup.rollups import rebuild_donation_totals, rebuild_daily_totals
+from setup.seed import seed, SEED_END_DATE
+from setup.image_gc import collect_images
+from setup.search import rebuild_search_index
 from flask import Flask,redirect
 from flask_cors import CORS
+import click
 
 application = create_app()
 CORS(application)
@@ -13,4 +18,61 @@ def home():
 # the decorator below registers the function as a shell context function
 @application.shell_context_processor 
 def make_shell_context():
-    return {'db': db,'User': User, 'Orphanage': Orphanage, 'Message': Message, 'Donation': Donation}
\ No newline at end of file
+    return {'db': db,'User': User, 'Orphanage': Orphanage, 'Message': Message, 'Donation': Donation}
+
+
+@application.cli.command('seed')
+@click.option('--users', default=100, help='Users to create')
+@click.option('--orphanages', default=100, help='Orphanages to create')
+@click.option('--messages', default=1000, help='Messages to create')
+@click.option('--donations', default=10000, help='Donations to create')
+@click.option('--seed', 'random_seed', default=0, help='Random seed, the same seed and end date give the same data')
+@click.option('--chunk-size', default=10000, help='Rows per INSERT')
+@click.option('--end-date', type=click.DateTime(['%Y-%m-%d']), default=SEED_END_DATE.strftime('%Y-%m-%d'),
+              help='Timestamps fall in the year before this date')
+def seed_command(users, orphanages, messages, donations, random_seed, chunk_size, end_date):
+    """Fill the database with synthetic data for scale testing."""
+    seed(users, orphanages, messages, donations, random_seed, chunk_size, log=click.echo, end_date=end_date)
+
+
+@application.cli.command('rebuild-donation-totals')
+@click.option('--chunk-size', default=50000, help='Donations aggregated per query')
+def rebuild_donation_totals_command(chunk_size):
+    """Recompute the donation totals and daily buckets from the donations."""
+    orphs, users = rebuild_donation_totals(chunk_size)
+    click.echo(f'Rebuilt donation totals for {orphs} orphanages and {users} users')
+    buckets = rebuild_daily_totals(chunk_size)
+    click.echo(f'Rebuilt {buckets} daily donation buckets')
+
+
+@application.cli.command('rebuild-search-index')
+@click.option('--chunk-size', default=10000, help='Orphanages indexed per statement')
+def rebuild_search_index_command(chunk_size):
+    """Reindex the orphanages for full-text search."""
+    count = rebuild_search_index(chunk_size)
+    if count is None:
+        click.echo('Nothing to rebuild, this database indexes the orphanage columns directly')
+    else:
+        click.echo(f'Indexed {count} orphanages')
+
+
+@application.cli.command('purge-idempotency-keys')
+def purge_idempotency_keys_command():
+    """Delete the Idempotency-Keys older than IDEMPOTENCY_KEY_TTL."""
+    deleted = IdempotencyKey.purge_expired(application.config['IDEMPOTENCY_KEY_TTL'])
+    click.echo(f'Deleted {deleted} expired idempotency keys')
+
+
+@application.cli.command('collect-images')
+@click.option('--grace-hours', default=24, help='Only files older than this can go')
+@click.option('--quarantine', type=click.Path(file_okay=False),
+              help='Move the files to this directory instead of deleting them')
+@click.option('--dry-run', is_flag=True, help='Only count the files that would go')
+@click.option('--chunk-size', default=1000, help='Orphanages read per query')
+def collect_images_command(grace_hours, quarantine, dry_run, chunk_size):
+    """Delete the uploaded images that no orphanage references."""
+    stats = collect_images(application.config['UPLOAD_FOLDER'], grace_hours * 3600, quarantine, dry_run,
+                           chunk_size)
+    action = 'Would remove' if dry_run else 'Quarantined' if quarantine else 'Removed'
+    click.echo(f"{action} {stats['removed']} of {stats['files']} files ({stats['bytes']} bytes), "
+               f"{stats['referenced']} are referenced")
@@ -3,8 +3,13 @@ from config import Config
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_mail import Mail
+from setup.cache import TokenCache, ResponseCache
+from setup.passwords import PasswordHasher
+from setup.images import ImageVariants
+from setup.encoder import FastJSONEncoder
+from setup import sql_monitor
+from setup.logs import LogPipeline, BatchingRotatingFileHandler, CoalescingSMTPHandler, init_request_logging
 import logging
-from logging.handlers import SMTPHandler, RotatingFileHandler
 import os
 
 
@@ -13,24 +18,50 @@ db = SQLAlchemy()
 migrate = Migrate()
 # Init. the  Mail object
 mail = Mail()
+# Init. the API token cache
+token_cache = TokenCache()
+# Init. the response cache shared by all workers
+response_cache = ResponseCache()
+# Init. the password hashing pool
+passwords = PasswordHasher()
+# Init. the image variants pool
+image_variants = ImageVariants()
 
 
 def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
+    # JSON responses through orjson
+    if app.config['JSON_ENCODER'] == 'orjson':
+        app.json_encoder = FastJSONEncoder
     
     db.init_app(app)
     migrate.init_app(app, db, compare_type=True, render_as_batch=True)
     mail.init_app(app)
+    response_cache.init_app(app)
+    # Token cache invalidations go through the response cache file
+    token_cache.init_app(app, response_cache)
+    passwords.init_app(app)
+    image_variants.init_app(app)
+
+    # Opt-in slow query log and N+1 detection
+    if app.config['SQL_MONITOR']:
+        sql_monitor.init_app(app, db.get_engine(app))
 
     from setup.errors import bp as errors_bp
     app.register_blueprint(errors_bp)
 
+    # Uploaded images, served with long-lived caching
+    from setup.images import bp as images_bp
+    app.register_blueprint(images_bp)
+
     from setup.api import bp as api_bp
     app.register_blueprint(api_bp, url_prefix='/api')
 
     # Code below is for logging errors
     if not app.debug and not app.testing:
+        # The handlers below run on a background thread, behind a queue
+        handlers = []
         # Logging errors by mail:
         # If app not in debug mode, and there is a mail server
         if app.config['MAIL_SERVER']:
@@ -42,38 +73,44 @@ def create_app(config_class=Config):
             if app.config['MAIL_USE_TLS']:
                 secure =()
             mailport = (app.config['MAIL_SERVER'], app.config['MAIL_PORT'])
-            mail_handler = SMTPHandler(
+            # Errors are collected and sent together, at most one mail per MAIL_LOG_INTERVAL
+            mail_handler = CoalescingSMTPHandler(
                 mailhost= mailport,
                 fromaddr='no-reply@' + app.config['MAIL_SERVER'],
                 toaddrs= app.config['ADMINS'], subject='Microblog Failure',
-                credentials=auth, secure = secure
+                credentials=auth, secure = secure,
+                interval=app.config['MAIL_LOG_INTERVAL']
             )
             mail_handler.setLevel(logging.ERROR)
-            app.logger.addHandler(mail_handler)
+            handlers.append(mail_handler)
 
         if app.config['LOG_TO_STDOUT']:
             stream_handler = logging.StreamHandler()
             stream_handler.setLevel(logging.INFO)
-            app.logger.addHandler(stream_handler)
+            handlers.append(stream_handler)
         else:
             # Logging errors to log file:
             # If the path doesn't exist, create it
             if not os.path.exists('logs'):
                 os.mkdir('logs')
-            # Create the RotatingFileHandler object, 
+            # Create the RotatingFileHandler object (it flushes in batches),
             # set its custom formatting and logging level
-            file_handler = RotatingFileHandler(
+            file_handler = BatchingRotatingFileHandler(
                 filename='logs/microblog.log',
-                maxBytes=10240,
-                backupCount=10
+                maxBytes=app.config['LOG_MAX_BYTES'],
+                backupCount=10,
+                flush_interval=app.config['LOG_FLUSH_INTERVAL']
             )
             file_handler.setFormatter(
                 logging.Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:line%(lineno)d]')
             )
             file_handler.setLevel(logging.INFO)
-            # Add the handler to app.logger, set logging level and info
-            app.logger.addHandler(file_handler)
-            
+            handlers.append(file_handler)
+
+        # Add the queue in front of the handlers to app.logger, set logging level and info
+        pipeline = LogPipeline(handlers, app.config['LOG_QUEUE_SIZE'])
+        app.logger.addHandler(pipeline.start())
+        init_request_logging(app)
         app.logger.setLevel(logging.INFO)
         app.logger.info('Microblog startup')
 
@@ -2,7 +2,7 @@ from flask import Blueprint, render_template
 
 bp = Blueprint('api', __name__)
 
-from setup.api import users, errors, tokens
+from setup.api import users, errors, tokens, metrics
 
 @bp.route('/')
 def home():
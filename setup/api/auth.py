@@ -1,4 +1,5 @@
 from flask_httpauth import HTTPBasicAuth, HTTPTokenAuth
+from setup import passwords
 from setup.models import User
 from setup.api.errors import error_response
 
@@ -8,6 +9,10 @@ token_auth = HTTPTokenAuth()
 def verify_password(username, password):
     user = User.query.filter_by(username=username).first()
     if user and user.check_password(password):
+        # Hashes made with an older policy are upgraded now that we have the password,
+        # the caller commits
+        if passwords.needs_rehash(user.password_hash):
+            user.set_password(password)
         return user
 
 
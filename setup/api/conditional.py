@@ -0,0 +1,90 @@
+from flask import current_app, g, request
+from functools import wraps
+from datetime import timezone
+from hashlib import md5
+from sqlalchemy import func
+from setup import db
+from setup.models import User, Orphanage
+
+
+def conditional(validators):
+    # `validators` gets the view's arguments and returns (etag, last_modified)
+    # from cheap queries, so a matching conditional GET is answered with a 304
+    # before the view loads or serializes anything. An etag of None means no
+    # validator applies (e.g. the resource doesn't exist) and the view runs as usual.
+    def decorator(f):
+        @wraps(f)
+        def wrapped(*args, **kwargs):
+            etag, last_modified = validators(*args, **kwargs)
+            if etag is None:
+                return f(*args, **kwargs)
+            # The response cache keys its entries on it
+            g.etag = etag
+            if not_modified(etag, last_modified):
+                response = current_app.response_class(status=304)
+            else:
+                response = current_app.make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            if last_modified is not None:
+                response.last_modified = last_modified
+            # Clients may keep the body but must revalidate it on every use
+            response.cache_control.no_cache = True
+            return response
+        return wrapped
+    return decorator
+
+
+def not_modified(etag, last_modified):
+    # If-None-Match takes precedence over If-Modified-Since (RFC 7232)
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if request.if_modified_since and last_modified is not None:
+        last_modified = last_modified.replace(microsecond=0, tzinfo=timezone.utc)
+        return last_modified <= request.if_modified_since
+    return False
+
+
+def wants_totals():
+    # Donation totals change without touching updated_at, so responses that
+    # include them are neither validated nor cached
+    return request.args.get('totals', 0, type=int) == 1
+
+
+def version_stamp(updated_at):
+    return updated_at.strftime('%Y%m%d%H%M%S%f') if updated_at else '0'
+
+
+def query_stamp():
+    # The query string changes the body, so it is part of a collection's etag
+    return md5(request.query_string).hexdigest()
+
+
+def row_validators(model):
+    def validators(id):
+        if wants_totals():
+            return None, None
+        row = db.session.query(model.id, model.updated_at).filter_by(id=id).first()
+        if row is None:
+            return None, None
+        etag = f'{model.__tablename__}-{id}-{version_stamp(row.updated_at)}-{query_stamp()}'
+        return etag, row.updated_at
+    return validators
+
+
+def collection_validators(model):
+    def validators():
+        if wants_totals():
+            return None, None
+        # The count catches deletions, the newest updated_at catches inserts and updates
+        count, updated_at = db.session.query(func.count(model.id), func.max(model.updated_at)).one()
+        etag = f'{model.__tablename__}s-{count}-{version_stamp(updated_at)}-{query_stamp()}'
+        # No Last-Modified: a deletion doesn't move the newest updated_at
+        return etag, None
+    return validators
+
+
+user_validators = row_validators(User)
+orphanage_validators = row_validators(Orphanage)
+orphanages_validators = collection_validators(Orphanage)
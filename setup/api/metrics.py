@@ -0,0 +1,59 @@
+from flask import g, request, has_request_context
+from prometheus_client import CollectorRegistry, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest, multiprocess
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from time import perf_counter
+from setup.api import bp
+import os
+
+# Under gunicorn, set PROMETHEUS_MULTIPROC_DIR (an empty directory shared by the
+# workers) before starting it: every worker then writes its samples there and
+# /api/metrics adds them up, instead of reporting only the worker it hit.
+REQUEST_LATENCY = Histogram('api_request_duration_seconds', 'Latency of the API requests',
+                            ['endpoint', 'method', 'status'])
+REQUEST_QUERIES = Histogram('api_request_db_queries', 'SQL statements run per API request', ['endpoint'],
+                            buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 200, float('inf')))
+REQUEST_DB_TIME = Histogram('api_request_db_seconds', 'Time spent running SQL per API request', ['endpoint'])
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'metrics_start' in g:
+        conn.info.setdefault('metrics_query_start', []).append(perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_query(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('metrics_query_start')
+    if starts and has_request_context() and 'metrics_start' in g:
+        g.metrics_db_time += perf_counter() - starts.pop()
+        g.metrics_queries += 1
+
+
+@bp.before_request
+def start_request_timer():
+    g.metrics_start = perf_counter()
+    g.metrics_queries = 0
+    g.metrics_db_time = 0.0
+
+
+@bp.after_request
+def record_request(response):
+    if 'metrics_start' not in g:
+        return response
+    endpoint = request.endpoint
+    REQUEST_LATENCY.labels(endpoint, request.method, response.status_code).observe(perf_counter() - g.metrics_start)
+    REQUEST_QUERIES.labels(endpoint).observe(g.metrics_queries)
+    REQUEST_DB_TIME.labels(endpoint).observe(g.metrics_db_time)
+    return response
+
+
+@bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    # Prometheus text format, aggregated over all the workers in multiprocess mode
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR') or os.environ.get('prometheus_multiproc_dir'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), 200, {'Content-Type': CONTENT_TYPE_LATEST}
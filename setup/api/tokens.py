@@ -1,10 +1,15 @@
 from flask import jsonify, request, current_app
-from setup import db
+from setup import db, image_variants
 from setup.api import bp
 from setup.api.auth import verify_password, token_auth
 from setup.api.errors import error_response
+from setup.models import StoredFile
+from setup.images import UPLOAD_URL_PREFIX, upload_filename
+import hashlib
 import os
-import uuid
+import tempfile
+
+UPLOAD_CHUNK_SIZE = 64 * 1024
 
 @bp.route('/tokens', methods=['POST'])
 def get_token():
@@ -34,25 +39,67 @@ def save_file(file_data):
     # Check if file is allowed, if not, return 'not allowed'
     if not allowed_file(f.filename):
         return "Not allowed"
-    unique = str(uuid.uuid4())
-    file_ext = os.path.splitext(f.filename)[1]
-    # Use uuid with file extension to save
-    filename = unique + file_ext
+    file_ext = os.path.splitext(f.filename)[1].lower()
     target = current_app.config['UPLOAD_FOLDER']
     # There's an error with upload folder abs path
     if not os.path.isdir(target):
-        os.mkdir(target)
-    file_path = os.path.join(target, filename)
-    f.save(file_path)
-    output = 'static/images/' + filename
+        os.makedirs(target)
+    # Hash the upload while copying it to a temp file, a chunk at a time
+    digest = hashlib.sha256()
+    size = 0
+    fd, temp_path = tempfile.mkstemp(dir=target, prefix='.upload-')
+    try:
+        with os.fdopen(fd, 'wb') as temp:
+            for chunk in iter(lambda: f.stream.read(UPLOAD_CHUNK_SIZE), b''):
+                digest.update(chunk)
+                temp.write(chunk)
+                size += len(chunk)
+        # Same bytes, same name: a re-upload adds a reference instead of a copy.
+        # Sharded in ab/cd/ subdirectories so none of them grows too big.
+        digest = digest.hexdigest()
+        filename = f'{digest[:2]}/{digest[2:4]}/{digest}{file_ext}'
+        # The reference is committed once the file is in place, and its row
+        # stays locked until then, so a concurrent delete_file waits for it
+        StoredFile.acquire(filename, digest, size)
+        try:
+            os.makedirs(os.path.join(target, digest[:2], digest[2:4]), exist_ok=True)
+            os.replace(temp_path, os.path.join(target, filename))
+        except OSError:
+            db.session.rollback()
+            raise
+        db.session.commit()
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    output = UPLOAD_URL_PREFIX + filename
     return output
 
 def delete_file(filepath):
-    filename = filepath.split('/')[2] # after static/images
+    filename = upload_filename(filepath)
+    if filename is None:
+        return "File doesn't exist"
     target = current_app.config['UPLOAD_FOLDER']
-    file_path = os.path.join(target, filename)
+    file_path = os.path.join(target, *filename.split('/'))
+    # The release keeps the row locked until the commit, after the blob is
+    # gone, so a re-upload of the same bytes can't slip in between
+    last_reference = StoredFile.release(filename)
+    if last_reference is False:
+        # Other uploads still point at this blob
+        db.session.commit()
+        return filename
     # If file doesn't exists,return an error
     if not os.path.exists(file_path):
+        db.session.commit()
         return "File doesn't exist"
-    os.remove(file_path)
-    return filename
\ No newline at end of file
+    try:
+        os.remove(file_path)
+    except OSError:
+        db.session.rollback()
+        raise
+    db.session.commit()
+    # Variants are remade on demand, one removed under a re-upload comes back
+    for variant in image_variants.variants:
+        variant_path = os.path.join(target, *image_variants.variant_path(filename, variant).split('/'))
+        if os.path.exists(variant_path):
+            os.remove(variant_path)
+    return filename
@@ -1,24 +1,131 @@
-from flask import jsonify, request, url_for, current_app
-from setup.models import User, Orphanage, Message, Donation
+from flask import jsonify, request, url_for, current_app, json, stream_with_context
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import load_only, joinedload
+from setup.models import User, Orphanage, Message, Donation, IdempotencyKey, encode_cursor, decode_cursor, keyset_filter
 from setup.api import bp
-from setup import db
+from setup import db, token_cache, response_cache, image_variants
 from setup.api.errors import bad_request, error_response
 from setup.api.auth import token_auth
 from setup.api.tokens import save_file, delete_file
-import logging
+from setup.images import upload_filename, send_upload
+from setup.rollups import donation_series, add_rows_to_totals
+from setup.search import search_query, search_terms
+from setup.geo import KM_PER_DEGREE, covering_cells, haversine
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError
+from decimal import Decimal, InvalidOperation
+from setup.api.conditional import conditional, wants_totals, user_validators, orphanage_validators, \
+    orphanages_validators
+from datetime import date, datetime, timedelta
+
+
+def paginated_response(model, query, per_page, endpoint, dict_kwargs=None, sort=None, nulls=True, **kwargs):
+    # '?after=<cursor>' switches to cursor pagination ('?after=' starts from the first row),
+    # otherwise the usual 'page' pagination is used. `sort` is one of model.sort_keys,
+    # with a '-' in front for descending order. `nulls=False` when the query can't
+    # return NULLs in the sort columns.
+    order, descending = None, False
+    if sort:
+        descending = sort.startswith('-')
+        order = model.sort_keys[sort.lstrip('-')]
+        kwargs['sort'] = sort
+    if 'after' in request.args:
+        with_total = request.args.get('total', 0, type=int) == 1
+        try:
+            data = model.to_cursor_dict(query, request.args['after'], per_page, endpoint, with_total,
+                                        dict_kwargs, order, descending, nulls, **kwargs)
+        except ValueError:
+            return bad_request('Invalid cursor')
+    else:
+        page = request.args.get('page', 1, type=int)
+        if order:
+            columns = [getattr(model, name) for name in order]
+            query = query.order_by(*[column.desc() if descending else column for column in columns])
+        data = model.to_collection_dict(query, page, per_page, endpoint, dict_kwargs, **kwargs)
+    return jsonify(data)
+
+def multi_get_response(model, query, dict_kwargs=None):
+    # '?ids=1,5,9': those rows in that order, fetched with one IN query, plus the
+    # ids that don't exist under "missing" (at most 100 ids)
+    try:
+        ids = [int(id) for id in request.args['ids'].split(',') if id.strip()]
+    except ValueError:
+        return bad_request('ids must be a comma separated list of integers')
+    ids = list(dict.fromkeys(ids))
+    if not ids or len(ids) > 100:
+        return bad_request('ids must list between 1 and 100 ids')
+    rows = {row.id: row for row in query.filter(model.id.in_(ids))}
+    return jsonify({
+        'items': [rows[id].to_dict(**(dict_kwargs or {})) for id in ids if id in rows],
+        'missing': [id for id in ids if id not in rows]
+    })
+
+def totals_options(model):
+    # '?totals=1' adds the donation totals, loaded in the same query as the rows
+    if wants_totals():
+        return [joinedload(model.donation_total)], {'include_totals': True}, {'totals': 1}
+    return [], {}, {}
+
+def orphanage_options(sort=None):
+    # '?fields=name,country' only loads and returns those columns (and id, always
+    # returned). The columns of `sort` are loaded too, the next cursor is made of them.
+    options, dict_kwargs, url_kwargs = totals_options(Orphanage)
+    fields = [field for field in request.args.get('fields', '').split(',') if field]
+    if fields:
+        unknown = [field for field in fields if field != 'id' and field not in Orphanage.api_fields]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+        columns = Orphanage.sort_keys[sort.lstrip('-')] if sort else Orphanage.cursor_columns
+        options.append(load_only(*fields, *[column for column in columns if column not in fields]))
+        dict_kwargs['fields'] = fields
+        url_kwargs['fields'] = ','.join(fields)
+    # '?variants=1' adds the URLs of the resized photos
+    if request.args.get('variants', 0, type=int) == 1:
+        dict_kwargs['include_variants'] = True
+        url_kwargs['variants'] = 1
+    return options, dict_kwargs, url_kwargs
+
+def orphanage_filters():
+    # '?country=', '?acttype=', '?students_min=', '?students_max=' and '?sort=' (name,
+    # students or id, '-name' for descending, students by default with a students range).
+    # Anything else is rejected with ValueError.
+    filters, url_kwargs = [], {}
+    for field in ['country', 'acttype']:
+        if request.args.get(field):
+            filters.append(getattr(Orphanage, field) == request.args[field])
+            url_kwargs[field] = request.args[field]
+    for arg in ['students_min', 'students_max']:
+        if arg in request.args:
+            value = request.args.get(arg, type=int)
+            if value is None:
+                raise ValueError(f'{arg} must be an integer')
+            filters.append(Orphanage.students >= value if arg == 'students_min' else Orphanage.students <= value)
+            url_kwargs[arg] = value
+    sort = request.args.get('sort')
+    if sort is not None and (sort[1:] if sort.startswith('-') else sort) not in Orphanage.sort_keys:
+        raise ValueError(f"sort must be one of {', '.join(Orphanage.sort_keys)}, with '-' for descending")
+    # A students range is only served by the (.., students, id) indexes in that order
+    if 'students_min' in url_kwargs or 'students_max' in url_kwargs:
+        if sort is None:
+            sort = 'students'
+        elif sort.lstrip('-') != 'students':
+            raise ValueError('students_min and students_max only go with sort=students or sort=-students')
+    return filters, sort, url_kwargs
 
 @bp.route('/user/<int:id>', methods=['GET'])
 @token_auth.login_required
+@conditional(user_validators)
 def get_user(id):
-    return jsonify(User.query.get_or_404(id).to_dict())
+    return jsonify(User.query.get_or_404(id).to_dict(include_totals=wants_totals()))
 
 @bp.route('/users', methods=['GET'])
 @token_auth.login_required
 def get_users():
-    page = request.args.get('page', 1, type=int)
     per_page = min(request.args.get('per_page', 10, type=int), 100)
-    data = User.to_collection_dict(User.query, page, per_page, 'api.get_users')# under items
-    return jsonify(data)
+    options, dict_kwargs, url_kwargs = totals_options(User)
+    if 'ids' in request.args:
+        return multi_get_response(User, User.query.options(*options), dict_kwargs)
+    return paginated_response(User, User.query.options(*options), per_page, 'api.get_users',
+                              dict_kwargs, **url_kwargs)# under items
 
 @bp.route('/users', methods=['POST'])
 def create_user():
@@ -57,6 +164,8 @@ def update_user(id):
         return bad_request('Please use a different email address. Email address already taken')
     user.from_dict(data)
     db.session.commit()
+    # The cached snapshot of this user is now stale
+    token_cache.invalidate(user.token)
     return jsonify(user.to_dict())
 
 @bp.route('/user/<int:id>', methods=['DELETE'])
@@ -65,19 +174,101 @@ def delete_user(id):
     if token_auth.current_user().id != id:
         return error_response(403, 'You are not allowed to delete another user')
     user = User.query.get_or_404(id)
-    name = user.name
+    name = user.username
+    token = user.token
     db.session.delete(user)
     db.session.commit()
+    token_cache.invalidate(token)
     return jsonify({'deleted_user': name})
 
 @bp.route('/orphanages', methods=['GET'])
+@conditional(orphanages_validators)
+@response_cache.cached('orphanages', unless=wants_totals)
 def get_orphanages():
-    page = request.args.get('page', 1, type=int)
     per_page = min(request.args.get('per_page', 100, type=int), 100)
-    orphs = Orphanage.to_collection_dict(Orphanage.query, page, per_page, 'api.get_orphanages')# under items
-    current_app.logger.setLevel(logging.INFO)
-    current_app.logger.info(orphs)
-    return jsonify(orphs)
+    try:
+        filters, sort, filter_kwargs = orphanage_filters()
+        options, dict_kwargs, url_kwargs = orphanage_options(sort)
+    except ValueError as e:
+        return bad_request(str(e))
+    if 'ids' in request.args:
+        return multi_get_response(Orphanage, Orphanage.query.options(*options), dict_kwargs)
+    query = Orphanage.query.filter(*filters).options(*options)
+    # A students range leaves out the orphanages without a students count
+    nulls = 'students_min' not in filter_kwargs and 'students_max' not in filter_kwargs
+    return paginated_response(Orphanage, query, per_page, 'api.get_orphanages', dict_kwargs, sort, nulls,
+                              **url_kwargs, **filter_kwargs)# under items
+
+@bp.route('/orphanages/search', methods=['GET'])
+@conditional(orphanages_validators)
+@response_cache.cached('orphanages', unless=wants_totals)
+def search_orphanages():
+    # '?q=' words found in the name, heading, story, activities or good_work; best matches first
+    q = request.args.get('q', '')
+    if not search_terms(q):
+        return bad_request('Must include a search query in q')
+    page = request.args.get('page', 1, type=int)
+    per_page = min(request.args.get('per_page', 10, type=int), 100)
+    try:
+        options, dict_kwargs, url_kwargs = orphanage_options()
+    except ValueError as e:
+        return bad_request(str(e))
+    query = search_query(q).options(*options)
+    return jsonify(Orphanage.to_collection_dict(query, page, per_page, 'api.search_orphanages', dict_kwargs,
+                                                q=q, **url_kwargs))
+
+@bp.route('/orphanages/nearby', methods=['GET'])
+@conditional(orphanages_validators)
+@response_cache.cached('orphanages', unless=wants_totals)
+def nearby_orphanages():
+    # '?lat=&lng=&radius=' (km, default 10): the orphanages within radius, closest first
+    lat = request.args.get('lat', type=float)
+    lng = request.args.get('lng', type=float)
+    radius = request.args.get('radius', 10, type=float)
+    if lat is None or lng is None or not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return bad_request('Must include lat (-90 to 90) and lng (-180 to 180)')
+    if not 0 < radius <= current_app.config['NEARBY_MAX_RADIUS_KM']:
+        return bad_request(f"radius must be more than 0 and at most {current_app.config['NEARBY_MAX_RADIUS_KM']} km")
+    page = request.args.get('page', 1, type=int)
+    per_page = min(request.args.get('per_page', 10, type=int), 100)
+    try:
+        options, dict_kwargs, url_kwargs = orphanage_options()
+    except ValueError as e:
+        return bad_request(str(e))
+    # The geohash index narrows the rows down to a few cells around the point,
+    # the exact distance is only computed for those
+    candidates = db.session.query(Orphanage.id, Orphanage.latitude, Orphanage.longitude) \
+        .filter(Orphanage.latitude.between(lat - radius / KM_PER_DEGREE, lat + radius / KM_PER_DEGREE))
+    cells = covering_cells(lat, lng, radius)
+    if cells:
+        candidates = candidates.filter(or_(*[and_(Orphanage.geohash >= cell, Orphanage.geohash < cell + '~')
+                                             for cell in cells]))
+    distances = sorted((haversine(lat, lng, row.latitude, row.longitude), row.id) for row in candidates)
+    distances = [(distance, id) for distance, id in distances if distance <= radius]
+    page_distances = distances[(page - 1) * per_page:page * per_page]
+    orphs = {orph.id: orph for orph in
+             Orphanage.query.options(*options).filter(Orphanage.id.in_([id for _, id in page_distances]))}
+    items = []
+    for distance, id in page_distances:
+        item = orphs[id].to_dict(**dict_kwargs)
+        item['distance_km'] = round(distance, 3)
+        items.append(item)
+    total_pages = (len(distances) + per_page - 1) // per_page
+    url_kwargs.update(lat=lat, lng=lng, radius=radius, per_page=per_page)
+    return jsonify({
+        'items': items,
+        '_meta': {
+            'page': page,
+            'per_page': per_page,
+            'total_pages': total_pages,
+            'total_items': len(distances)
+        },
+        '_links': {
+            'self': url_for('api.nearby_orphanages', page=page, **url_kwargs),
+            'next': url_for('api.nearby_orphanages', page=page+1, **url_kwargs) if page < total_pages else None,
+            'prev': url_for('api.nearby_orphanages', page=page-1, **url_kwargs) if page > 1 else None
+        }
+    })
 
 @bp.route('/orphanages', methods=['POST'])
 @token_auth.login_required
@@ -99,14 +290,21 @@ def create_orphanage():
     orph.from_dict(data)
     db.session.add(orph)
     db.session.commit()
+    response_cache.bump('orphanages')
     response = jsonify(orph.to_dict())
     response.status_code = 201
     response.headers['Location'] = url_for('api.get_orphanage', id=orph.id)
     return response
 
 @bp.route('/orphanage/<int:id>', methods=['GET'])
+@conditional(orphanage_validators)
+@response_cache.cached('orphanages', unless=wants_totals)
 def get_orphanage(id):
-    return jsonify(Orphanage.query.get_or_404(id).to_dict())
+    try:
+        options, dict_kwargs, _ = orphanage_options()
+    except ValueError as e:
+        return bad_request(str(e))
+    return jsonify(Orphanage.query.options(*options).get_or_404(id).to_dict(**dict_kwargs))
 
 
 @bp.route('/orphanage/<int:id>', methods=['PUT'])
@@ -124,6 +322,7 @@ def update_orphanage(id):
         return error_response(401, 'Admin status is required to update an orphanage')
     orph.from_dict(data)
     db.session.commit()
+    response_cache.bump('orphanages')
     return jsonify(orph.to_dict())
 
 @bp.route('/orphanage/<int:id>', methods=['DELETE'])
@@ -135,6 +334,7 @@ def delete_orphanage(id):
     name = orph.name
     db.session.delete(orph)
     db.session.commit()
+    response_cache.bump('orphanages')
     return jsonify({'deleted_orphanage': name})
 
 @bp.route('/messages', methods=['POST'])
@@ -153,14 +353,21 @@ def contact_us():
 
 @bp.route('/messages', methods=['GET'])
 def get_messages():
-    page = request.args.get('page', 1, type=int)
     per_page = min(request.args.get('per_page', 10, type=int), 100)
-    messages = Message.to_collection_dict(Message.query, page, per_page, 'api.get_messages')# under items
-    return jsonify(messages)
+    return paginated_response(Message, Message.query, per_page, 'api.get_messages')# under items
 
 @bp.post('/donations')
 def add_donation():
     data = request.get_json() or {}
+    # A retried request with the same Idempotency-Key gets the original response back
+    key = request.headers.get('Idempotency-Key')
+    if key is not None:
+        if not key or len(key) > 255:
+            return bad_request('Idempotency-Key must be between 1 and 255 characters')
+        request_hash = IdempotencyKey.fingerprint(data)
+        stored = IdempotencyKey.lookup(key, current_app.config['IDEMPOTENCY_KEY_TTL'])
+        if stored is not None:
+            return replay_response(stored, request_hash)
     for field in ['username', 'orphanage_name', 'amount']:
         if field not in data:
             return bad_request('Must include all required fields')
@@ -173,32 +380,246 @@ def add_donation():
         return bad_request('Orphanage not found')
     donation = Donation(amount=data['amount'], donor=user, recipient=orph)
     db.session.add(donation)
-    db.session.commit()
-    response = jsonify({'status': 'Donation successfully added'})
+    donation.add_to_totals()
+    result = {'status': 'Donation successfully added'}
+    if key is not None:
+        # Saved in the donation's transaction, so either both exist or neither does
+        db.session.add(IdempotencyKey(key=key, request_hash=request_hash, status_code=201,
+                                      response_body=json.dumps(result)))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        # A concurrent request with the same key got there first
+        stored = IdempotencyKey.query.get(key) if key is not None else None
+        if stored is None:
+            raise
+        return replay_response(stored, request_hash)
+    response = jsonify(result)
     response.status_code = 201
     return response
 
+def replay_response(stored, request_hash):
+    if stored.request_hash != request_hash:
+        return error_response(422, 'This Idempotency-Key was already used with a different request')
+    response = current_app.response_class(stored.response_body, status=stored.status_code,
+                                          mimetype='application/json')
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+@bp.post('/donations/batch')
+@token_auth.login_required
+def add_donations():
+    if not token_auth.current_user().is_admin: # if the user is not an admin
+        return error_response(401, 'Admin status is required to add donations in bulk')
+    # Takes a JSON array or an NDJSON stream (one donation per line). Each
+    # error names the donation's index in the batch, and its line for NDJSON.
+    if request.mimetype == 'application/x-ndjson':
+        records = ndjson_records(request.stream)
+    elif not request.is_json:
+        return bad_request('Body must be a JSON array or an NDJSON stream of donations')
+    else:
+        try:
+            items = json.loads(request.get_data())
+        except ValueError as e:
+            return bad_request(f'Body is not valid JSON: {e}')
+        if not isinstance(items, list):
+            return bad_request('Body must be a JSON array or an NDJSON stream of donations')
+        records = (({'index': index}, item) for index, item in enumerate(items))
+    chunk_size = current_app.config['DONATION_BATCH_SIZE']
+    inserted, errors, chunk = 0, [], []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) == chunk_size:
+            inserted += insert_donations(chunk, errors)
+            chunk = []
+    if chunk:
+        inserted += insert_donations(chunk, errors)
+    response = jsonify({'inserted': inserted, 'failed': len(errors), 'errors': errors})
+    response.status_code = 201
+    return response
+
+class InvalidJSON():
+    # Stands for an NDJSON line that doesn't parse
+    def __init__(self, error):
+        self.error = error
+
+def ndjson_records(stream):
+    # ({'index', 'line'}, donation or InvalidJSON), blank lines are skipped
+    index = 0
+    for line_number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError as e:
+            item = InvalidJSON(str(e))
+        yield {'index': index, 'line': line_number}, item
+        index += 1
+
+def insert_donations(chunk, errors):
+    # Validates a chunk, resolves its names with one IN query per table and
+    # inserts it with a single executemany, in its own transaction
+    valid = []
+    for where, item in chunk:
+        if isinstance(item, InvalidJSON):
+            errors.append(dict(where, error=f'Invalid JSON: {item.error}'))
+            continue
+        if not isinstance(item, dict):
+            errors.append(dict(where, error='Must be a JSON object'))
+            continue
+        missing = [field for field in ['username', 'orphanage_name', 'amount'] if field not in item]
+        if missing:
+            errors.append(dict(where, error=f"Missing required fields: {', '.join(missing)}"))
+            continue
+        if not isinstance(item['username'], str) or not isinstance(item['orphanage_name'], str):
+            errors.append(dict(where, error='Username and orphanage name must be strings'))
+            continue
+        try:
+            amount = Decimal(str(item['amount']))
+        except InvalidOperation:
+            amount = None
+        if amount is None or not amount.is_finite():
+            errors.append(dict(where, error='Amount must be a number'))
+            continue
+        valid.append((where, item, amount))
+    users = dict(db.session.query(User.username, User.id)
+                 .filter(User.username.in_({item['username'] for _, item, _ in valid})))
+    orphs = dict(db.session.query(Orphanage.name, Orphanage.id)
+                 .filter(Orphanage.name.in_({item['orphanage_name'] for _, item, _ in valid})))
+    now = datetime.utcnow()
+    rows, saved = [], []
+    for where, item, amount in valid:
+        if item['username'] not in users:
+            errors.append(dict(where, error=f"User not found: {item['username']}"))
+        elif item['orphanage_name'] not in orphs:
+            errors.append(dict(where, error=f"Orphanage not found: {item['orphanage_name']}"))
+        else:
+            rows.append({'amount': amount, 'user_id': users[item['username']],
+                         'orph_id': orphs[item['orphanage_name']], 'donation_time': now})
+            saved.append(where)
+    if not rows:
+        return 0
+    try:
+        db.session.execute(Donation.__table__.insert(), rows)
+        add_rows_to_totals(rows)
+        db.session.commit()
+    except SQLAlchemyError:
+        db.session.rollback()
+        current_app.logger.exception('Donation batch insert failed')
+        errors.extend(dict(where, error='Could not be saved') for where in saved)
+        return 0
+    return len(rows)
+
+@bp.route('/donations/stats', methods=['GET'])
+@token_auth.login_required
+def get_donation_stats():
+    if not token_auth.current_user().is_admin: # if the user is not an admin
+        return error_response(401, "Admin status is required to view donation statistics")
+    granularity = request.args.get('granularity', 'day')
+    if granularity not in ['day', 'week', 'month']:
+        return bad_request("'granularity' must be one of 'day', 'week' or 'month'")
+    try:
+        end = date.fromisoformat(request.args.get('end', datetime.utcnow().date().isoformat()))
+        start = date.fromisoformat(request.args.get('start', (end - timedelta(days=29)).isoformat()))
+    except ValueError:
+        return bad_request("'start' and 'end' must be dates in the YYYY-MM-DD format")
+    if start > end or (end - start).days > 3660:
+        return bad_request("'start' must be before 'end' and at most 10 years apart")
+    orph_id = request.args.get('orphanage_id', type=int)
+    if orph_id is not None:
+        Orphanage.query.options(load_only('id')).get_or_404(orph_id)
+        series = donation_series(granularity, start, end, orph_id)
+    else:
+        series = donation_series(granularity, start, end)
+    result = {
+        'granularity': granularity,
+        'orphanage_id': orph_id,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'series': series
+    }
+    return jsonify(result)
+
 @bp.route('/orphanage_donations/<int:id>')
 @token_auth.login_required
 def get_donations(id):
-    orph = Orphanage.query.get_or_404(id)
+    orph = Orphanage.query.options(load_only('name')).get_or_404(id)
     if not token_auth.current_user().is_admin: # if the user is not an admin
         return error_response(401, "Admin status is required to view an orphanage's donations")
-    # convert this orphanage's donations to dict
-    donations = [each.to_dict() for each in orph.donations]
-    result = {'donations': donations, 'orphanage_name': orph.name}
+    # One query for the donations and their donors' usernames, in cursor order
+    columns = [Donation.donation_time, Donation.id]
+    query = db.session.query(Donation.id, Donation.donation_time, Donation.amount, User.username) \
+        .outerjoin(User, Donation.user_id == User.id).filter(Donation.orph_id == id).order_by(*columns)
+    after = request.args.get('after', '')
+    if after:
+        try:
+            query = query.filter(keyset_filter(columns, decode_cursor(after, columns)))
+        except ValueError:
+            return bad_request('Invalid cursor')
+    if request.args.get('stream', 0, type=int) == 1:
+        return stream_donations(query, orph.name)
+    per_page = min(request.args.get('per_page', 100, type=int), 1000)
+    rows = query.limit(per_page + 1).all()
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_cursor([rows[-1].donation_time, rows[-1].id])
+    result = {
+        'donations': [Donation.row_to_dict(row, orph.name) for row in rows],
+        'orphanage_name': orph.name,
+        '_meta': {'per_page': per_page, 'after': after, 'next_cursor': next_cursor},
+        '_links': {
+            'self': url_for('api.get_donations', id=id, after=after, per_page=per_page),
+            'next': url_for('api.get_donations', id=id, after=next_cursor, per_page=per_page)
+            if next_cursor else None
+        }
+    }
     return jsonify(result)
 
+def stream_donations(query, orph_name, batch_size=500):
+    # Writes the JSON out in batches of rows while they are fetched, so memory
+    # stays flat however many donations the orphanage has
+    def generate():
+        yield '{"orphanage_name": %s, "donations": [' % json.dumps(orph_name)
+        batch = []
+        separator = ''
+        for row in query.yield_per(batch_size):
+            batch.append(json.dumps(Donation.row_to_dict(row, orph_name)))
+            if len(batch) == batch_size:
+                yield separator + ','.join(batch)
+                separator = ','
+                batch = []
+        if batch:
+            yield separator + ','.join(batch)
+        yield ']}'
+    return current_app.response_class(stream_with_context(generate()), mimetype='application/json')
+
 @bp.post('/image_upload')
 def image_upload():
     _file = request.files['file']
     filepath = save_file(_file)
     if filepath == "Not allowed":
         return error_response(415, "File is not an image of type 'png','jpg','jpeg' or 'gif'.")
-    response = jsonify({'filepath': filepath})
+    # The resized copies are made in the background, their URLs work right away
+    image_variants.schedule(current_app.config['UPLOAD_FOLDER'], upload_filename(filepath))
+    response = jsonify({'filepath': filepath, 'variants': image_variants.urls(filepath)})
     response.status_code = 201
     return response
 
+@bp.route('/images/<variant>/<path:filename>', methods=['GET'])
+def get_image_variant(variant, filename):
+    # Serves a resized copy of an uploaded image, making it first if it's missing
+    filename = upload_filename(filename)
+    if variant not in image_variants.variants or filename is None:
+        return error_response(404)
+    folder = current_app.config['UPLOAD_FOLDER']
+    path = image_variants.ensure(folder, filename, variant)
+    if path is None:
+        return error_response(404, f"File {filename} does not exist")
+    return send_upload(folder, path)
+
 @bp.route('/image_delete', methods=['POST'])
 @token_auth.login_required
 def delete_image():
@@ -208,7 +629,7 @@ def delete_image():
     filepath = data['filepath']
     filename = delete_file(filepath)
     if filename == "File doesn't exist": 
-        file = filepath.split('/')[2] # after static/images
+        file = upload_filename(filepath) or filepath # after static/images
         return error_response(404, f"File {file} does not exist")
     return jsonify({'deleted_file': filename})
 
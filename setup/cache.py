@@ -0,0 +1,301 @@
+from collections import OrderedDict
+from datetime import datetime
+from functools import wraps
+from hashlib import md5
+from threading import Lock, local
+from time import monotonic, time
+from urllib.parse import urlencode
+from flask import current_app, g, request
+from prometheus_client import Counter
+from sqlalchemy.orm import make_transient_to_detached
+import os
+import sqlite3
+
+# Lookups per cache ('token' or 'response') and result ('hit' or 'miss'),
+# reported by /api/metrics
+CACHE_LOOKUPS = Counter('cache_lookups_total', 'Cache lookups', ['cache', 'result'])
+
+
+class TokenCache():
+    # Maps API tokens to a snapshot of the owning user's columns so that
+    # token_auth can resolve hot tokens without querying the users table.
+    # The entries live in each process, so invalidations are published through
+    # a version stamp in the shared response cache file: every lookup checks
+    # it and entries stamped with an older version are dropped.
+    # Limits:
+    # - Without a shared file (RESPONSE_CACHE_PATH empty) there is nowhere to
+    #   publish invalidations, so the cache is disabled and every request
+    #   looks its token up in the database.
+    # - Only writes made through the ORM session bump the stamp. A user or
+    #   token changed with raw SQL (or by another program) keeps
+    #   authenticating from the cache for up to TOKEN_CACHE_TTL seconds; run
+    #   token_cache.invalidate_all() after such a change.
+    namespace = 'tokens'
+
+    def __init__(self, app=None, stamps=None):
+        self.max_size = 1024
+        self.ttl = 60
+        self.hits = 0
+        self.misses = 0
+        self.stamps = None
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        if app is not None:
+            self.init_app(app, stamps)
+
+    def init_app(self, app, stamps=None):
+        self.max_size = app.config.get('TOKEN_CACHE_SIZE', self.max_size)
+        self.ttl = app.config.get('TOKEN_CACHE_TTL', self.ttl)
+        self.stamps = stamps if stamps is not None and stamps.path else None
+        self.clear()
+
+    @property
+    def enabled(self):
+        return bool(self.max_size) and self.stamps is not None
+
+    def stamp(self):
+        # Current invalidation version, None when it can't be read (no caching then)
+        if not self.enabled:
+            return None
+        try:
+            return self.stamps.version(self.namespace)
+        except sqlite3.Error as e:
+            current_app.logger.warning('Token cache stamp lookup failed: %s', e)
+            return None
+
+    def get(self, token, model):
+        stamp = self.stamp()
+        if stamp is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is not None and (entry[1] <= monotonic() or entry[2] != stamp):
+                # Expired, by the TTL or the token's own expiration, or invalidated
+                del self._entries[token]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                CACHE_LOOKUPS.labels('token', 'miss').inc()
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+        CACHE_LOOKUPS.labels('token', 'hit').inc()
+        return self._attach(model, entry[0])
+
+    def set(self, token, user, stamp):
+        # `stamp` must be read before the user was loaded, so that an
+        # invalidation published in between isn't missed
+        if not self.enabled or stamp is None:
+            return
+        # Never keep a token past its expiration, whatever the TTL says
+        remaining = (user.token_expiration - datetime.utcnow()).total_seconds()
+        ttl = min(self.ttl, remaining)
+        if ttl <= 0:
+            return
+        columns = {column.key: getattr(user, column.key)
+                   for column in user.__mapper__.column_attrs}
+        with self._lock:
+            self._entries[token] = (columns, monotonic() + ttl, stamp)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, token):
+        if token is None:
+            return
+        with self._lock:
+            self._entries.pop(token, None)
+        self.invalidate_all()
+
+    def invalidate_all(self):
+        # Drops the entries of every worker
+        if self.enabled:
+            self.stamps.bump(self.namespace)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hit_rate,
+        }
+
+    @staticmethod
+    def _attach(model, columns):
+        # Rebuild the row as a detached instance and merge it without a load,
+        # so the view gets a session-bound user and no SELECT is emitted.
+        from setup import db
+        user = model(**columns)
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
+
+class ResponseCache():
+    # Response cache shared by every worker process through a local SQLite
+    # file. Entries are stamped with their namespace's version at the time
+    # they were built; bumping the version hides them all at once. Keys carry
+    # the database they were built from and, behind @conditional, the ETag
+    # computed from the rows, so writes the app didn't see (another database,
+    # a script) can't serve a stale body. Hits only read the file.
+    schema = [
+        """CREATE TABLE IF NOT EXISTS response_cache (
+            key TEXT PRIMARY KEY, namespace TEXT, version INTEGER, status INTEGER,
+            mimetype TEXT, body BLOB, size INTEGER, last_access REAL)""",
+        "CREATE INDEX IF NOT EXISTS ix_response_cache_last_access ON response_cache (last_access)",
+        "CREATE TABLE IF NOT EXISTS cache_version (namespace TEXT PRIMARY KEY, version INTEGER)",
+        # Running total of the body sizes, so a store doesn't have to add them up
+        "CREATE TABLE IF NOT EXISTS cache_meta (name TEXT PRIMARY KEY, value INTEGER)",
+        "INSERT OR IGNORE INTO cache_meta SELECT 'size', coalesce(sum(size), 0) FROM response_cache",
+    ]
+    # A hit refreshes the entry's LRU position at most this often (seconds)
+    touch_interval = 60
+
+    def __init__(self, app=None):
+        self.path = None
+        self.max_bytes = 64 * 1024 * 1024
+        self.database = ''
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._local = local()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.path = app.config.get('RESPONSE_CACHE_PATH')
+        self.max_bytes = app.config.get('RESPONSE_CACHE_MAX_BYTES', self.max_bytes)
+        self.database = md5(app.config['SQLALCHEMY_DATABASE_URI'].encode('utf-8')).hexdigest()[:12]
+        if self.path:
+            with self._connection() as conn:
+                for statement in self.schema:
+                    conn.execute(statement)
+
+    def _connection(self):
+        # One connection per thread, reopened after gunicorn forks the worker
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def version(self, namespace):
+        row = self._connection().execute(
+            'SELECT version FROM cache_version WHERE namespace = ?', (namespace,)).fetchone()
+        return row[0] if row else 0
+
+    def bump(self, namespace):
+        # Called after a write so that the next read rebuilds the response
+        if not self.path:
+            return
+        try:
+            with self._connection() as conn:
+                conn.execute('INSERT OR IGNORE INTO cache_version VALUES (?, 0)', (namespace,))
+                conn.execute('UPDATE cache_version SET version = version + 1 WHERE namespace = ?', (namespace,))
+                size = conn.execute('SELECT coalesce(sum(size), 0) FROM response_cache WHERE namespace = ?',
+                                    (namespace,)).fetchone()[0]
+                conn.execute('DELETE FROM response_cache WHERE namespace = ?', (namespace,))
+                self._add_size(conn, -size)
+        except sqlite3.Error as e:
+            current_app.logger.warning('Response cache invalidation failed: %s', e)
+
+    def key(self, namespace, etag=None):
+        key = f'{self.database}:{namespace}:{request.path}?' + urlencode(sorted(request.args.items(multi=True)))
+        return key if etag is None else key + '#' + etag
+
+    def get(self, key, version):
+        conn = self._connection()
+        row = conn.execute('SELECT status, mimetype, body, last_access FROM response_cache '
+                           'WHERE key = ? AND version = ?', (key, version)).fetchone()
+        if row is None:
+            self.misses += 1
+            CACHE_LOOKUPS.labels('response', 'miss').inc()
+            return None
+        self.hits += 1
+        CACHE_LOOKUPS.labels('response', 'hit').inc()
+        now = time()
+        if row[3] < now - self.touch_interval:
+            with conn:
+                conn.execute('UPDATE response_cache SET last_access = ? WHERE key = ?', (now, key))
+        return row[:3]
+
+    def set(self, namespace, key, version, response):
+        body = response.get_data()
+        conn = self._connection()
+        with conn:
+            old = conn.execute('SELECT size FROM response_cache WHERE key = ?', (key,)).fetchone()
+            conn.execute('INSERT OR REPLACE INTO response_cache VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                         (key, namespace, version, response.status_code, response.mimetype,
+                          body, len(body), time()))
+            total = self._add_size(conn, len(body) - (old[0] if old else 0))
+            if total > self.max_bytes:
+                self._evict(conn, total)
+
+    def _evict(self, conn, total):
+        # Drop the least recently used entries until the cache fits in max_bytes
+        evicted = freed = 0
+        for key, size in conn.execute('SELECT key, size FROM response_cache ORDER BY last_access').fetchall():
+            if total - freed <= self.max_bytes:
+                break
+            conn.execute('DELETE FROM response_cache WHERE key = ?', (key,))
+            freed += size
+            evicted += 1
+        self._add_size(conn, -freed)
+        self.evictions += evicted
+
+    @staticmethod
+    def _add_size(conn, delta):
+        conn.execute("UPDATE cache_meta SET value = value + ? WHERE name = 'size'", (delta,))
+        return conn.execute("SELECT value FROM cache_meta WHERE name = 'size'").fetchone()[0]
+
+    def stats(self):
+        # Entries and size of the shared file, lookups of this process
+        if not self.path:
+            return {}
+        conn = self._connection()
+        entries = conn.execute('SELECT count(*) FROM response_cache').fetchone()[0]
+        size = conn.execute("SELECT value FROM cache_meta WHERE name = 'size'").fetchone()[0]
+        return {'entries': entries, 'size': size, 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions}
+
+    def cached(self, namespace, unless=None):
+        # Caches successful responses of a view, keyed on its path and query string.
+        # Requests for which `unless()` is true bypass the cache.
+        def decorator(f):
+            @wraps(f)
+            def wrapped(*args, **kwargs):
+                if not self.path or (unless is not None and unless()):
+                    return f(*args, **kwargs)
+                # Set by @conditional, ties the entry to the state of the rows
+                key = self.key(namespace, g.get('etag'))
+                try:
+                    version = self.version(namespace)
+                    row = self.get(key, version)
+                except sqlite3.Error as e:
+                    current_app.logger.warning('Response cache lookup failed: %s', e)
+                    return f(*args, **kwargs)
+                if row is not None:
+                    status, mimetype, body = row
+                    return current_app.response_class(body, status=status, mimetype=mimetype)
+                response = current_app.make_response(f(*args, **kwargs))
+                if response.status_code == 200:
+                    try:
+                        self.set(namespace, key, version, response)
+                    except sqlite3.Error as e:
+                        current_app.logger.warning('Response cache store failed: %s', e)
+                return response
+            return wrapped
+        return decorator
@@ -0,0 +1,26 @@
+from flask.json import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class FastJSONEncoder(JSONEncoder):
+    # Flask's JSON encoder with the compact case (every jsonify outside debug)
+    # handed to orjson, when it's installed. The output is the stdlib's: dates
+    # still go through default() (HTTP dates), Decimals become strings, keys
+    # are sorted if JSON_SORT_KEYS is set. Only float exponents are spelled
+    # differently (1e20 for 1e+20) and NaN becomes null. Pretty printing, ASCII
+    # escaping, or anything orjson can't encode (ints over 64 bits, ...) falls
+    # back to the stdlib encoder.
+    def encode(self, o):
+        if orjson is None or self.indent is not None or self.ensure_ascii or self.skipkeys:
+            return super().encode(o)
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        try:
+            return orjson.dumps(o, default=self.default, option=option).decode('utf-8')
+        except (orjson.JSONEncodeError, TypeError):
+            return super().encode(o)
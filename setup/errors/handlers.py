@@ -1,7 +1,11 @@
 from flask import render_template, request
 from setup.errors import bp
-from setup import db
+from sqlalchemy import inspect
+from sqlalchemy.orm.exc import StaleDataError
+from setup import db, token_cache
+from setup.api.auth import token_auth
 from setup.api.errors import error_response as api_error_response
+from setup.models import User
 
 def wants_json_response():
     # If client prefers json over html
@@ -15,6 +19,26 @@ def not_found_error(error):
 def too_large_error(error):
     return api_error_response(413, "Image should not be larger than 500 KB")
 
+@bp.app_errorhandler(503)
+def unavailable_error(error):
+    response = api_error_response(503, error.description)
+    response.headers['Retry-After'] = '1'
+    return response
+
+@bp.app_errorhandler(StaleDataError)
+def stale_data_error(error):
+    # A row was deleted under the request. When it's the user the token
+    # authenticated (e.g. a cached token of a user deleted by another worker),
+    # the token doesn't authenticate anyone anymore.
+    db.session.rollback()
+    user = token_auth.current_user()
+    if user is not None:
+        id = inspect(user).identity[0]
+        if db.session.query(User.id).filter_by(id=id).first() is None:
+            token_cache.invalidate_all()
+            return api_error_response(401)
+    return api_error_response(409, 'The resource was changed by another request, please retry')
+
 @bp.app_errorhandler(500)
 def internal_error(error):
     db.session.rollback()
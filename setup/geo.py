@@ -0,0 +1,88 @@
+from math import asin, cos, pi, radians, sin, sqrt
+
+# Geohashes name nested lat/lng cells with a base32 string, longer = smaller
+# cell, and nearby points share a prefix. An index on the geohash column
+# turns "points in these few cells" into a handful of index range scans.
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+EARTH_RADIUS_KM = 6371.0
+# Length of a degree of latitude on the same sphere haversine() uses, so the
+# bounds derived from it never cut off a point within the radius
+KM_PER_DEGREE = pi * EARTH_RADIUS_KM / 180
+GEOHASH_PRECISION = 12
+
+
+def encode(lat, lng, precision=GEOHASH_PRECISION):
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        # Bits alternate between longitude and latitude, longitude first
+        interval, coordinate = (lng_range, lng) if even else (lat_range, lat)
+        middle = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits, value = 0, 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    # (height, width) of a cell in degrees
+    lng_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lng_bits
+
+
+def covering_cells(lat, lng, radius_km):
+    # Geohash prefixes whose cells together cover the circle: the cell of the
+    # center and its 8 neighbours, at the finest precision where a cell is
+    # still at least radius_km across. Empty when no precision fits (huge
+    # radius, or near a pole), meaning every row is a candidate.
+    shrink = cos(radians(min(abs(lat) + radius_km / KM_PER_DEGREE, 90.0)))
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        height, width = cell_size(precision)
+        if height * KM_PER_DEGREE >= radius_km and width * KM_PER_DEGREE * shrink >= radius_km:
+            break
+    else:
+        return []
+    cells = set()
+    for dlat in (-height, 0, height):
+        for dlng in (-width, 0, width):
+            cell_lat = max(-90.0, min(90.0, lat + dlat))
+            cell_lng = (lng + dlng + 180.0) % 360.0 - 180.0
+            cells.add(encode(cell_lat, cell_lng, precision))
+    return sorted(cells)
+
+
+def haversine(lat1, lng1, lat2, lng2):
+    # Great-circle distance in km
+    dlat, dlng = radians(lat2 - lat1), radians(lng2 - lng1)
+    a = sin(dlat / 2) ** 2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * asin(min(1.0, sqrt(a)))
+
+
+def location_coordinates(location):
+    # (lat, lng) from the free-form location JSON: {'lat': .., 'lng': ..} (or
+    # latitude/longitude/lon), [lat, lng] or "lat,lng". (None, None) otherwise.
+    lat = lng = None
+    if isinstance(location, dict):
+        lat = next((location[key] for key in ['lat', 'latitude'] if key in location), None)
+        lng = next((location[key] for key in ['lng', 'lon', 'long', 'longitude'] if key in location), None)
+    elif isinstance(location, (list, tuple)) and len(location) == 2:
+        lat, lng = location
+    elif isinstance(location, str) and location.count(',') == 1:
+        lat, lng = location.split(',')
+    try:
+        lat, lng = float(lat), float(lng)
+    except (TypeError, ValueError):
+        return None, None
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return None, None
+    return lat, lng
@@ -0,0 +1,100 @@
+from time import time
+from setup import db, image_variants
+from setup.models import Orphanage, StoredFile
+from setup.images import upload_filename
+import os
+import re
+import shutil
+
+# Columns that can point at uploaded images: photos_links and the certificate
+# hold paths, the long text fields may embed them in HTML
+PATH_COLUMNS = ['photos_links', 'registration_certificate']
+TEXT_COLUMNS = ['story', 'activities', 'good_work', 'money_uses', 'heading']
+_image_paths = re.compile(r'static/images/([^\s"\'<>()?#]+)')
+
+
+def referenced_files(chunk_size=1000):
+    # Upload folder paths referenced by an orphanage, reading the table a
+    # chunk of ids at a time and only the columns that matter
+    columns = [getattr(Orphanage, column) for column in PATH_COLUMNS + TEXT_COLUMNS]
+    referenced = set()
+    last_id = 0
+    while True:
+        rows = db.session.query(Orphanage.id, *columns).filter(Orphanage.id > last_id) \
+            .order_by(Orphanage.id).limit(chunk_size).all()
+        if not rows:
+            break
+        for row in rows:
+            photos, certificate = row[1], row[2]
+            paths = list(photos or []) if isinstance(photos, list) else []
+            if certificate:
+                paths.append(certificate)
+            names = []
+            for path in paths:
+                if isinstance(path, str):
+                    # '/static/images/...' and 'https://host/static/images/...'
+                    # point at the upload folder as well
+                    names.extend(_image_paths.findall(path) or [path])
+            for text in row[3:]:
+                if text:
+                    names.extend(_image_paths.findall(text))
+            for name in names:
+                filename = upload_filename(name)
+                if filename is not None:
+                    referenced.add(filename)
+        last_id = rows[-1][0]
+        db.session.expunge_all()
+    # The variants of a referenced image are in use as well
+    for filename in list(referenced):
+        for variant in image_variants.variants:
+            referenced.add(image_variants.variant_path(filename, variant))
+    return referenced
+
+
+def upload_files(folder, skip=None):
+    # Yields (relative path, DirEntry) for every file below folder, one
+    # directory at a time instead of listing the whole tree up front
+    directories = ['']
+    while directories:
+        relative = directories.pop()
+        with os.scandir(os.path.join(folder, relative)) as entries:
+            for entry in entries:
+                path = f'{relative}/{entry.name}' if relative else entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    if skip is None or os.path.abspath(entry.path) != skip:
+                        directories.append(path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield path, entry
+
+
+def collect_images(folder, grace, quarantine=None, dry_run=False, chunk_size=1000):
+    # Deletes (or moves to `quarantine`) the files of the upload folder that
+    # no orphanage references and that are older than `grace` seconds. The
+    # grace period covers images uploaded for an orphanage not saved yet.
+    referenced = referenced_files(chunk_size)
+    cutoff = time() - grace
+    if quarantine is not None:
+        quarantine = os.path.abspath(quarantine)
+    stats = {'files': 0, 'referenced': 0, 'removed': 0, 'bytes': 0}
+    for path, entry in upload_files(folder, skip=quarantine):
+        stats['files'] += 1
+        if path in referenced:
+            stats['referenced'] += 1
+            continue
+        info = entry.stat(follow_symlinks=False)
+        if info.st_mtime > cutoff:
+            continue
+        stats['removed'] += 1
+        stats['bytes'] += info.st_size
+        if dry_run:
+            continue
+        # The blob goes, so does its reference count
+        StoredFile.query.filter_by(path=path).delete(synchronize_session=False)
+        db.session.commit()
+        if quarantine is None:
+            os.remove(entry.path)
+        else:
+            target = os.path.join(quarantine, *path.split('/'))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.move(entry.path, target)
+    return stats
@@ -0,0 +1,165 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from flask import Blueprint, abort, current_app, request, url_for
+from werkzeug.security import safe_join
+from werkzeug.utils import send_file
+import logging
+import os
+import posixpath
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+bp = Blueprint('images', __name__)
+
+UPLOAD_URL_PREFIX = 'static/images/'
+FORMATS = {'png': 'PNG', 'jpg': 'JPEG', 'jpeg': 'JPEG', 'gif': 'GIF', 'webp': 'WEBP'}
+
+
+def upload_filename(filepath):
+    # 'static/images/ab/cd/<digest>.png' -> 'ab/cd/<digest>.png', None if it
+    # points outside the upload folder
+    if filepath.startswith(UPLOAD_URL_PREFIX):
+        filepath = filepath[len(UPLOAD_URL_PREFIX):]
+    filename = posixpath.normpath(filepath)
+    if filename.startswith(('/', '..')) or filename == '.':
+        return None
+    return filename
+
+
+def send_upload(folder, filename):
+    # Uploaded files are never rewritten under the same name (content hash or
+    # uuid), so browsers and proxies may keep them for good. Range and
+    # conditional requests are answered by send_file, or by the front server
+    # when IMAGE_SENDFILE hands it the file instead of streaming it from here.
+    path = safe_join(folder, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    mode = current_app.config['IMAGE_SENDFILE']
+    response = send_file(os.path.abspath(path), request.environ, conditional=True,
+                         max_age=current_app.config['IMAGE_MAX_AGE'], use_x_sendfile=bool(mode),
+                         response_class=current_app.response_class)
+    if mode == 'x-accel-redirect':
+        # nginx wants the URI of an 'internal' location mapped to UPLOAD_FOLDER, not a path
+        del response.headers['X-Sendfile']
+        response.headers['X-Accel-Redirect'] = current_app.config['IMAGE_ACCEL_PREFIX'].rstrip('/') + '/' + filename
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+@bp.route('/static/images/<path:filename>')
+def uploaded_image(filename):
+    return send_upload(current_app.config['UPLOAD_FOLDER'], filename)
+
+
+class ImageVariants():
+    # Resized/recompressed copies of the uploaded images, written next to the
+    # original as '<name>_<variant>.<ext>' by a small thread pool (Pillow
+    # releases the GIL while resizing and encoding). A variant is made once,
+    # and made again on demand if its file goes missing.
+    def __init__(self, app=None):
+        self.variants = {}
+        self.quality = 80
+        self.workers = 2
+        self._executor = None
+        self._pid = None
+        self._lock = Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.variants = app.config.get('IMAGE_VARIANTS', self.variants)
+        self.quality = app.config.get('IMAGE_VARIANT_QUALITY', self.quality)
+        self.workers = app.config.get('IMAGE_VARIANT_WORKERS', self.workers)
+        self._pid = None
+
+    @property
+    def executor(self):
+        with self._lock:
+            # Threads don't survive a fork, each gunicorn worker gets its own pool
+            if self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='image-variants')
+                self._pid = os.getpid()
+            return self._executor
+
+    def variant_path(self, filename, variant):
+        # 'ab/cd/<digest>.png' -> 'ab/cd/<digest>_thumb.png' (or .webp for a WebP variant)
+        base, ext = os.path.splitext(filename)
+        image_format = self.variants[variant][1]
+        if image_format:
+            ext = '.' + image_format.lower()
+        return f'{base}_{variant}{ext}'
+
+    def is_variant(self, filename):
+        base = os.path.splitext(filename)[0]
+        return any(base.endswith('_' + variant) for variant in self.variants)
+
+    def urls(self, filepath):
+        # {variant: URL} for an uploaded image's 'static/images/...' path, none
+        # for other links (external images have no variants)
+        if not filepath or not filepath.startswith(UPLOAD_URL_PREFIX):
+            return {}
+        filename = upload_filename(filepath)
+        if filename is None:
+            return {}
+        return {variant: url_for('api.get_image_variant', variant=variant, filename=filename)
+                for variant in self.variants}
+
+    def schedule(self, folder, filename):
+        # Makes every variant of an upload in the background
+        for variant in self.variants:
+            self.executor.submit(self._generate_logged, folder, filename, variant)
+
+    def ensure(self, folder, filename, variant):
+        # Returns the variant's path, making it now if it's missing. None when
+        # the original is gone or can't be read as an image.
+        if self.is_variant(filename):
+            return None
+        path = self.variant_path(filename, variant)
+        if os.path.exists(os.path.join(folder, path)):
+            return path
+        if self.executor.submit(self.generate, folder, filename, variant).result():
+            return path
+        return None
+
+    def _generate_logged(self, folder, filename, variant):
+        try:
+            self.generate(folder, filename, variant)
+        except Exception:
+            logger.exception('Failed to make the %s variant of %s', variant, filename)
+
+    def generate(self, folder, filename, variant):
+        try:
+            from PIL import Image, UnidentifiedImageError
+        except ImportError:
+            logger.warning('Pillow is not installed, image variants are disabled')
+            return False
+        source = os.path.join(folder, filename)
+        target = os.path.join(folder, self.variant_path(filename, variant))
+        if os.path.exists(target):
+            return True
+        if not os.path.exists(source):
+            return False
+        size, image_format = self.variants[variant]
+        image_format = FORMATS[(image_format or os.path.splitext(filename)[1][1:]).lower()]
+        try:
+            with Image.open(source) as image:
+                # GIFs keep their first frame only
+                image.seek(0)
+                image = image.copy()
+        except (UnidentifiedImageError, OSError):
+            return False
+        image.thumbnail((size, size))
+        if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        # Written under a temp name and renamed, so a reader never sees half a file
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(target), prefix='.variant-')
+        try:
+            with os.fdopen(fd, 'wb') as temp:
+                image.save(temp, image_format, quality=self.quality, optimize=True)
+            os.replace(temp_path, target)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        return True
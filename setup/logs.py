@@ -0,0 +1,238 @@
+from flask import g, request
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, SMTPHandler
+from email.message import EmailMessage
+from email.utils import localtime
+from threading import Lock, Timer
+from time import monotonic
+import atexit
+import json
+import os
+import queue
+import random
+import smtplib
+
+
+class DroppingQueueHandler(QueueHandler):
+    # Never blocks the request: when the queue is full the record is dropped
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class BatchingRotatingFileHandler(RotatingFileHandler):
+    # Writes go to the stream's buffer and reach the disk at most every
+    # `flush_interval` seconds, instead of one flush per record
+    def __init__(self, *args, flush_interval=1.0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.flush_interval = flush_interval
+        self._timer = None
+        self._size = None
+
+    def shouldRollover(self, record):
+        # Tracks the file size itself, seeking to the end would flush the buffer
+        if self.stream is None:
+            self.stream = self._open()
+        if self._size is None:
+            self._size = os.path.getsize(self.baseFilename)
+        length = len(self.format(record)) + 1
+        if self.maxBytes > 0 and self._size + length >= self.maxBytes:
+            self._size = length
+            return True
+        self._size += length
+        return False
+
+    def flush(self):
+        # StreamHandler.emit calls this after every record
+        if self.flush_interval <= 0:
+            super().flush()
+        elif self._timer is None:
+            self._timer = Timer(self.flush_interval, self.flush_now)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush_now(self):
+        with self.lock:
+            self._timer = None
+            super().flush()
+
+    def before_fork(self):
+        # Held across the fork and written out, so the child inherits an
+        # empty buffer instead of writing the master's lines a second time
+        self.acquire()
+        if self.stream is not None:
+            self.stream.flush()
+
+    def after_fork_in_parent(self):
+        self.release()
+
+    def after_fork_in_child(self):
+        # The master's timer thread doesn't exist here, a new one must be
+        # started for the next record (logging resets self.lock itself)
+        self._timer = None
+
+    def close(self):
+        with self.lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            self.flush_interval = 0
+        super().close()
+
+
+class CoalescingSMTPHandler(SMTPHandler):
+    # Collects records and mails them together, at most one mail every
+    # `interval` seconds and `capacity` records per mail (the rest are counted)
+    def __init__(self, *args, interval=60, capacity=50, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.interval = interval
+        self.capacity = capacity
+        self._records = []
+        self._dropped = 0
+        self._last_sent = None
+        self._timer = None
+        self._buffer_lock = Lock()
+
+    def emit(self, record):
+        with self._buffer_lock:
+            if len(self._records) < self.capacity:
+                self._records.append(self.format(record))
+            else:
+                self._dropped += 1
+            if self._timer is None:
+                delay = 0 if self._last_sent is None else max(0, self._last_sent + self.interval - monotonic())
+                self._timer = Timer(delay, self.send)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def send(self):
+        with self._buffer_lock:
+            records, dropped = self._records, self._dropped
+            self._records, self._dropped, self._timer = [], 0, None
+            self._last_sent = monotonic()
+        if not records:
+            return
+        body = '\n\n'.join(records)
+        if dropped:
+            body += f'\n\n... and {dropped} more'
+        msg = EmailMessage()
+        msg['From'] = self.fromaddr
+        msg['To'] = ','.join(self.toaddrs)
+        msg['Subject'] = f'{self.subject} ({len(records) + dropped} errors)'
+        msg['Date'] = localtime()
+        msg.set_content(body)
+        try:
+            smtp = smtplib.SMTP(self.mailhost, self.mailport or smtplib.SMTP_PORT, timeout=self.timeout)
+            try:
+                if self.username:
+                    if self.secure is not None:
+                        smtp.ehlo()
+                        smtp.starttls(*self.secure)
+                        smtp.ehlo()
+                    smtp.login(self.username, self.password)
+                smtp.send_message(msg)
+            finally:
+                smtp.quit()
+        except Exception:
+            self.handleError(None)
+
+    def before_fork(self):
+        self._buffer_lock.acquire()
+
+    def after_fork_in_parent(self):
+        self._buffer_lock.release()
+
+    def after_fork_in_child(self):
+        # The master sends the records it collected, the child starts over
+        # without its timer thread
+        self._buffer_lock = Lock()
+        self._records, self._dropped, self._timer = [], 0, None
+
+    def close(self):
+        with self._buffer_lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        self.send()
+        super().close()
+
+
+class LogPipeline():
+    # The app logger only puts records on a queue, a background thread hands
+    # them to the real (slow) handlers
+    def __init__(self, handlers, maxsize=10000):
+        self.handlers = handlers
+        self.maxsize = maxsize
+        self.queue_handler = DroppingQueueHandler(queue.Queue(maxsize))
+        self.listener = None
+
+    def start(self):
+        self._start_listener()
+        atexit.register(self.stop)
+        # A forked gunicorn worker doesn't inherit the listener thread, nor
+        # the handlers' timer threads
+        os.register_at_fork(before=self._before_fork, after_in_parent=self._after_fork_in_parent,
+                            after_in_child=self._restart_in_child)
+        return self.queue_handler
+
+    def _start_listener(self):
+        self.listener = QueueListener(self.queue_handler.queue, *self.handlers, respect_handler_level=True)
+        self.listener.start()
+
+    def _fork_hooks(self, name):
+        # Handlers without fork state (StreamHandler) have no hooks
+        return [getattr(handler, name) for handler in self.handlers if hasattr(handler, name)]
+
+    def _before_fork(self):
+        for hook in self._fork_hooks('before_fork'):
+            hook()
+
+    def _after_fork_in_parent(self):
+        for hook in reversed(self._fork_hooks('after_fork_in_parent')):
+            hook()
+
+    def _restart_in_child(self):
+        for hook in self._fork_hooks('after_fork_in_child'):
+            hook()
+        self.queue_handler.queue = queue.Queue(self.maxsize)
+        self._start_listener()
+
+    def stop(self):
+        if self.listener is None:
+            return
+        self.listener.stop()
+        self.listener = None
+        for handler in self.handlers:
+            handler.close()
+
+
+def init_request_logging(app):
+    # Logs a sample of the requests as one size-capped JSON line each,
+    # instead of whole response payloads
+    sample_rate = app.config['LOG_REQUEST_SAMPLE_RATE']
+    max_chars = app.config['LOG_REQUEST_MAX_CHARS']
+
+    @app.before_request
+    def start_timer():
+        g.request_start = monotonic()
+
+    @app.after_request
+    def log_request(response):
+        if sample_rate <= 0 or random.random() >= sample_rate or 'request_start' not in g:
+            return response
+        entry = {
+            'method': request.method,
+            'path': request.path,
+            'query': request.query_string.decode('utf-8', 'replace'),
+            'endpoint': request.endpoint,
+            'status': response.status_code,
+            'duration_ms': round((monotonic() - g.request_start) * 1000, 2),
+            'size': response.calculate_content_length(),
+        }
+        app.logger.info(json.dumps(entry)[:max_chars])
+        return response
@@ -1,8 +1,12 @@
-from setup import db
+from setup import db, token_cache, passwords, image_variants
+from setup.geo import encode as geohash_encode, location_coordinates
+from sqlalchemy import and_, or_, case, event, false, inspect
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
 from datetime import datetime, timedelta
+from decimal import Decimal
 from flask import current_app, url_for
 # For pwd verification, the following are imported
-from werkzeug.security import check_password_hash, generate_password_hash
 from hashlib import md5
 # For jwt token
 import jwt
@@ -13,12 +17,86 @@ import base64
 import os
 
 
+def encode_cursor(values):
+    # Opaque '?after=' token built from the sort key of the last row on a page
+    values = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('utf-8').rstrip('=')
+
+
+def decode_cursor(cursor, columns):
+    # Raises ValueError if the cursor wasn't produced by encode_cursor for these columns
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('utf-8')))
+    except (TypeError, ValueError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list) or len(values) != len(columns):
+        raise ValueError('Invalid cursor')
+    for i, column in enumerate(columns):
+        if isinstance(column.type, db.DateTime):
+            try:
+                values[i] = datetime.fromisoformat(values[i])
+            except (TypeError, ValueError):
+                raise ValueError('Invalid cursor')
+    return values
+
+
+def keyset_filter(columns, values, descending=False, nulls=False, tail_nulls=True):
+    # Rows strictly after `values` in (col1, col2, ...) order, ascending or
+    # descending. With `nulls`, NULLs of nullable columns are placed where the
+    # database sorts them: before every value on SQLite/MySQL, after them on Postgres.
+    # Without `tail_nulls`, the NULLs that come after a value of the first
+    # column are left out, for the caller to fetch with trailing_nulls().
+    column, value = columns[0], values[0]
+    if nulls and column.nullable and (tail_nulls or value is None):
+        after, bound = null_aware_after(column, value, descending)
+        same = column.is_(None) if value is None else column == value
+    else:
+        after = (column < value) if descending else (column > value)
+        bound = (column <= value) if descending else (column >= value)
+        same = column == value
+    if len(columns) == 1:
+        return after
+    condition = or_(after, and_(same, keyset_filter(columns[1:], values[1:], descending, nulls)))
+    # The redundant bound on the first column lets the database seek an index range
+    # instead of expanding the OR
+    return condition if bound is None else and_(bound, condition)
+
+
+def nulls_sort_first(descending):
+    nulls_first = db.engine.dialect.name != 'postgresql'
+    return not nulls_first if descending else nulls_first
+
+
+def trailing_nulls(column, value, descending):
+    # The rows left after `value` are the next values followed by the NULLs
+    # when NULLs sort last. ORing the two defeats the index, so the NULLs
+    # are fetched by a second query with this filter. None when there are none.
+    if value is None or not column.nullable or nulls_sort_first(descending):
+        return None
+    return column.is_(None)
+
+
+def null_aware_after(column, value, descending):
+    nulls_first = nulls_sort_first(descending)
+    if value is None:
+        # Every value comes after a leading NULL, nothing comes after a trailing one
+        return (column.isnot(None) if nulls_first else false()), None
+    after = (column < value) if descending else (column > value)
+    if not nulls_first:
+        return or_(after, column.is_(None)), None
+    return after, (column <= value) if descending else (column >= value)
+
+
 class PaginatedAPIMixin():
+    # Columns giving a unique, indexed order for cursor pagination
+    cursor_columns = ('id',)
+
     @staticmethod
-    def to_collection_dict(query, page, per_page, endpoint, **kwargs):
+    def to_collection_dict(query, page, per_page, endpoint, dict_kwargs=None, **kwargs):
         resources = query.paginate(page, per_page, False) #Paginate obj with items attr.
         data = {
-            'items': [item.to_dict() for item in resources.items],
+            'items': [item.to_dict(**(dict_kwargs or {})) for item in resources.items],
             '_meta': {
                 'page': page,
                 'per_page': per_page,
@@ -35,6 +113,46 @@ class PaginatedAPIMixin():
         }
         return data
 
+    @classmethod
+    def to_cursor_dict(cls, query, after, per_page, endpoint, with_total=False, dict_kwargs=None,
+                       order=None, descending=False, nulls=True, **kwargs):
+        # Keyset pagination: seeks past the last row seen instead of counting
+        # and skipping, so every page costs the same however deep it is.
+        # `order` replaces cursor_columns for a sort on other (nullable) columns,
+        # `nulls=False` when the query's filters already leave their NULLs out.
+        names = order or cls.cursor_columns
+        columns = [getattr(cls, name) for name in names]
+        ordering = [column.desc() if descending else column for column in columns]
+        page_query, tail = query, None
+        if after:
+            values = decode_cursor(after, columns)
+            nulls = nulls and order is not None
+            page_query = query.filter(keyset_filter(columns, values, descending, nulls, tail_nulls=False))
+            if nulls:
+                tail = trailing_nulls(columns[0], values[0], descending)
+        items = page_query.order_by(*ordering).limit(per_page + 1).all()
+        if tail is not None and len(items) <= per_page:
+            items += query.filter(tail).order_by(*ordering).limit(per_page + 1 - len(items)).all()
+        next_cursor = None
+        if len(items) > per_page:
+            items = items[:per_page]
+            next_cursor = encode_cursor([getattr(items[-1], name) for name in names])
+        data = {
+            'items': [item.to_dict(**(dict_kwargs or {})) for item in items],
+            '_meta': {
+                'per_page': per_page,
+                'after': after,
+                'next_cursor': next_cursor
+            },
+            '_links': {
+                'self': url_for(endpoint, after=after, per_page=per_page, **kwargs),
+                'next': url_for(endpoint, after=next_cursor, per_page=per_page, **kwargs)
+                if next_cursor else None
+            }
+        }
+        if with_total:
+            data['_meta']['total_items'] = query.order_by(None).count()
+        return data
 
 
 class User(PaginatedAPIMixin, db.Model):
@@ -46,23 +164,26 @@ class User(PaginatedAPIMixin, db.Model):
     last_seen = db.Column(db.DateTime, default = datetime.utcnow)
     is_admin = db.Column(db.Boolean, default=False)
     phone_no = db.Column(db.String(20))
+    # Bumped on every write, used for ETag/Last-Modified
+    updated_at = db.Column(db.DateTime, index=True, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Attrs. for API tokens
     token = db.Column(db.String(32), index=True, unique=True)
     token_expiration = db.Column(db.DateTime)
     # Attr for donation
     donations = db.relationship('Donation', backref='donor', lazy='dynamic')
+    donation_total = db.relationship('UserDonationTotal', uselist=False, cascade='all, delete-orphan')
 
     def __repr__(self) -> str:
         return f"<User {self.username}>" 
 
     def set_password(self, password):
         # Set the pwd_hash attr. to  the password_hash generated with the password given  
-        self.password_hash = generate_password_hash(password = password)
+        self.password_hash = passwords.hash(password)
     
     def check_password(self, password):
         # Returns True if the password provided by the user matches the hash
-        return check_password_hash(self.password_hash, password)
+        return passwords.verify(self.password_hash, password)
     
     
     def get_reset_password_token(self, expires_in=600):
@@ -81,7 +202,7 @@ class User(PaginatedAPIMixin, db.Model):
             return
         return User.query.get(id)
 
-    def to_dict(self):
+    def to_dict(self, include_totals=False):
         data = {
             'id': self.id,
             'username': self.username,
@@ -93,6 +214,8 @@ class User(PaginatedAPIMixin, db.Model):
                 'self': url_for('api.get_user', id=self.id),
             }
         }     
+        if include_totals:
+            data['donation_totals'] = DonationTotalMixin.totals_dict(self.donation_total)
         return data
     
     def from_dict(self, data):
@@ -106,22 +229,63 @@ class User(PaginatedAPIMixin, db.Model):
         now = datetime.utcnow()
         if self.token and self.token_expiration > now + timedelta(seconds=60):
             return self.token
+        # The old token is being rotated out, so drop it from the cache
+        token_cache.invalidate(self.token)
         self.token = base64.b64encode(os.urandom(24)).decode('utf-8')
         self.token_expiration = now + timedelta(seconds=expires_in)
         db.session.add(self)
         return self.token
 
     def revoke_token(self):
+        token_cache.invalidate(self.token)
         self.token_expiration = datetime.utcnow() - timedelta(seconds=1)
 
     @staticmethod
     def check_token(token):
+        # Hot tokens are resolved from the cache without a query
+        user = token_cache.get(token, User)
+        if user is not None:
+            return user
+        stamp = token_cache.stamp()
         user = User.query.filter_by(token=token).first()
         if user is None or user.token_expiration < datetime.utcnow():
             return None
+        token_cache.set(token, user, stamp)
         return user
 
 
+@event.listens_for(User, 'after_update')
+def user_updated(mapper, connection, target):
+    # The cached snapshots of the user, in every worker, are dropped once the
+    # change is committed
+    state = inspect(target)
+    if any(attr.history.has_changes() for attr in state.attrs):
+        state.session.info['users_changed'] = True
+
+
+@event.listens_for(User, 'after_delete')
+def user_deleted(mapper, connection, target):
+    inspect(target).session.info['users_changed'] = True
+
+
+@event.listens_for(Session, 'after_bulk_update')
+@event.listens_for(Session, 'after_bulk_delete')
+def users_changed(context):
+    if context.mapper.class_ is User:
+        context.session.info['users_changed'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def publish_user_changes(session):
+    if session.info.pop('users_changed', False):
+        token_cache.invalidate_all()
+
+
+@event.listens_for(Session, 'after_rollback')
+def forget_user_changes(session):
+    session.info.pop('users_changed', None)
+
+
 class Orphanage(db.Model, PaginatedAPIMixin):
     id = db.Column(db.Integer,primary_key = True)
     name = db.Column(db.String(64), index = True, unique = True)
@@ -144,47 +308,61 @@ class Orphanage(db.Model, PaginatedAPIMixin):
     registration_certificate = db.Column(db.String(250))
     heading = db.Column(db.String(250))
     blog_link = db.Column(db.String(250))
+    # Copied from `location` by from_dict, for /orphanages/nearby
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    geohash = db.Column(db.String(12), index=True)
+    # Bumped on every write, used for ETag/Last-Modified
+    updated_at = db.Column(db.DateTime, index=True, default=datetime.utcnow, onupdate=datetime.utcnow)
     donations = db.relationship('Donation', backref='recipient', lazy='dynamic')
+    donation_total = db.relationship('OrphanageDonationTotal', uselist=False, cascade='all, delete-orphan')
+    # Back the filters (country, acttype, students range) and sorts (name, students) of /orphanages
+    __table_args__ = (
+        db.Index('ix_orphanage_students_id', 'students', 'id'),
+        db.Index('ix_orphanage_country_students_id', 'country', 'students', 'id'),
+        db.Index('ix_orphanage_country_name', 'country', 'name'),
+        db.Index('ix_orphanage_country_id', 'country', 'id'),
+        db.Index('ix_orphanage_acttype_students_id', 'acttype', 'students', 'id'),
+        db.Index('ix_orphanage_acttype_name', 'acttype', 'name'),
+        db.Index('ix_orphanage_acttype_id', 'acttype', 'id'),
+    )
+
+    # '?sort=' keys of /orphanages ('-' in front for descending) -> columns to order by
+    sort_keys = {'id': ('id',), 'name': ('name', 'id'), 'students': ('students', 'id')}
+
+    # Fields returned by to_dict (besides id) and accepted by from_dict
+    api_fields = ['name', 'email', 'students', 'phone_no', 'location', 'activities', 'paypal_info',
+                  'social_media_links', 'story', 'money_uses', 'photos_links', 'bank_info', 'actId', 'acttype',
+                  'country', 'good_work', 'monthly_donation', 'registration_certificate', 'heading', 'blog_link']
 
     def __repr__(self):
         return f"<Orphanage {self.name}- {self.students} students>"
 
-    def to_dict(self):
-        data = {
-            'id': self.id,
-            'name': self.name,
-            'email': self.email,
-            'students': self.students,
-            'phone_no': self.phone_no,
-            'location': self.location,
-            'activities': self.activities,
-            'paypal_info': self.paypal_info,
-            'social_media_links': self.social_media_links,
-            'story': self.story,
-            'money_uses': self.money_uses,
-            'photos_links': self.photos_links,
-            'bank_info': self.bank_info,
-            'actId': self.actId,
-            'acttype': self.acttype,
-            'country': self.country,
-            'good_work': self.good_work,
-            'monthly_donation': self.monthly_donation,
-            'registration_certificate': self.registration_certificate,
-            'heading': self.heading,
-            'blog_link': self.blog_link,
-            '_links': {
-                'self': url_for('api.get_orphanage', id=self.id),
-            }
+    def to_dict(self, include_totals=False, fields=None, include_variants=False):
+        # Only the requested fields are read, so columns left out of the query stay unloaded
+        data = {'id': self.id}
+        for field in fields or self.api_fields:
+            data[field] = getattr(self, field)
+        if include_variants and 'photos_links' in data:
+            # The resized copies of each photo, in the same order as photos_links
+            data['photos_variants'] = [image_variants.urls(link) for link in data['photos_links'] or []]
+        data['_links'] = {
+            'self': url_for('api.get_orphanage', id=self.id),
         }
+        if include_totals:
+            data['donation_totals'] = DonationTotalMixin.totals_dict(self.donation_total)
         return data
 
     def from_dict(self, data):
-        columns = ['name', 'email', 'students', 'phone_no', 'location', 'activities', 'paypal_info', 'social_media_links',
-                   'story', 'money_uses', 'photos_links','bank_info','actId','acttype','country','good_work',
-                   'monthly_donation', 'registration_certificate', 'heading', 'blog_link']
-        for field in columns:
+        for field in self.api_fields:
             if field in data:
                 setattr(self, field, data[field])
+        if 'location' in data:
+            self.set_coordinates()
+
+    def set_coordinates(self):
+        self.latitude, self.longitude = location_coordinates(self.location)
+        self.geohash = geohash_encode(self.latitude, self.longitude) if self.latitude is not None else None
         
 class Message(db.Model, PaginatedAPIMixin):
     id = db.Column(db.Integer,primary_key = True)
@@ -193,7 +371,8 @@ class Message(db.Model, PaginatedAPIMixin):
     email = db.Column(db.String(120))
     phone_no = db.Column(db.String(20))
     content = db.Column(db.Text)
-    creation_datetime = db.Column(db.DateTime, default = datetime.utcnow)
+    creation_datetime = db.Column(db.DateTime, index = True, default = datetime.utcnow)
+    cursor_columns = ('creation_datetime', 'id')
 
     def from_dict(self, data):
         for field in ['first_name', 'last_name','email', 'phone_no', 'content']:
@@ -219,6 +398,9 @@ class Donation(db.Model):
     amount = db.Column(db.Numeric(12,2))
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     orph_id = db.Column(db.Integer, db.ForeignKey('orphanage.id'))
+    cursor_columns = ('donation_time', 'id')
+    # Serves an orphanage's donations in cursor order straight from the index
+    __table_args__ = (db.Index('ix_donation_orph_id_donation_time', 'orph_id', 'donation_time', 'id'),)
 
     def __repr__(self):
         return f"<Donation- {self.amount} donated by {self.donor.username} to {self.recipient.name}>"
@@ -231,5 +413,182 @@ class Donation(db.Model):
             'recipient_orphanage': self.recipient.name
         }
         return data
-        
 
+    def add_to_totals(self):
+        # Keeps the donation rollups in step with this donation, in the same transaction
+        if self.donation_time is None:
+            self.donation_time = datetime.utcnow()
+        amount = Decimal(str(self.amount))
+        OrphanageDonationTotal.increment(self.recipient.id, amount, 1, self.donation_time)
+        UserDonationTotal.increment(self.donor.id, amount, 1, self.donation_time)
+        DonationDailyTotal.increment(self.donation_time.date(), self.recipient.id, amount, 1)
+
+    @staticmethod
+    def row_to_dict(row, recipient_name):
+        # Same output as to_dict, from a (donation_time, amount, username) row
+        # so that listing donations doesn't load the donor and recipient
+        data = {
+            'donation_time': row.donation_time,
+            'amount': float(row.amount),
+            'donor': row.username,
+            'recipient_orphanage': recipient_name
+        }
+        return data
+
+
+class DonationTotalMixin():
+    # Running totals of the donations made to an orphanage or by a user, so that
+    # reading them is a primary key lookup instead of a SUM() over donations
+    total_raised = db.Column(db.Numeric(14,2), nullable=False, default=0)
+    donation_count = db.Column(db.Integer, nullable=False, default=0)
+    last_donation_time = db.Column(db.DateTime)
+
+    @classmethod
+    def increment(cls, key, amount, count, last_donation_time):
+        # Atomic in-place update, so concurrent donations don't overwrite each other
+        table = cls.__table__
+        key_column = table.primary_key.columns.values()[0]
+        update = table.update().where(key_column == key).values(
+            total_raised=table.c.total_raised + amount,
+            donation_count=table.c.donation_count + count,
+            last_donation_time=case(
+                (or_(table.c.last_donation_time == None, table.c.last_donation_time < last_donation_time),
+                 last_donation_time),
+                else_=table.c.last_donation_time)
+        )
+        if db.session.execute(update).rowcount:
+            return
+        try:
+            with db.session.begin_nested():
+                db.session.execute(table.insert().values({
+                    key_column.name: key, 'total_raised': amount, 'donation_count': count,
+                    'last_donation_time': last_donation_time
+                }))
+        except IntegrityError:
+            # A concurrent first donation inserted the row first
+            db.session.execute(update)
+
+    @staticmethod
+    def totals_dict(totals):
+        if totals is None:
+            return {'total_raised': 0.0, 'donation_count': 0, 'last_donation_time': None}
+        data = {
+            'total_raised': float(totals.total_raised),
+            'donation_count': totals.donation_count,
+            'last_donation_time': totals.last_donation_time.isoformat() + 'Z'
+            if totals.last_donation_time else None
+        }
+        return data
+
+
+class OrphanageDonationTotal(DonationTotalMixin, db.Model):
+    orph_id = db.Column(db.Integer, db.ForeignKey('orphanage.id'), primary_key=True)
+
+
+class UserDonationTotal(DonationTotalMixin, db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+
+
+class DonationDailyTotal(db.Model):
+    # Donations bucketed per day and orphanage (orph_id 0 holds every orphanage),
+    # weeks and months are summed up from these buckets
+    ALL_ORPHANAGES = 0
+    day = db.Column(db.Date, primary_key=True)
+    orph_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    total = db.Column(db.Numeric(14,2), nullable=False, default=0)
+    donation_count = db.Column(db.Integer, nullable=False, default=0)
+
+    @classmethod
+    def increment(cls, day, orph_id, amount, count):
+        # Updates the orphanage's bucket and the all orphanages one for that day
+        table = cls.__table__
+        for key in [orph_id, cls.ALL_ORPHANAGES]:
+            update = table.update().where(and_(table.c.day == day, table.c.orph_id == key)).values(
+                total=table.c.total + amount,
+                donation_count=table.c.donation_count + count
+            )
+            if db.session.execute(update).rowcount:
+                continue
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(table.insert().values(day=day, orph_id=key, total=amount,
+                                                             donation_count=count))
+            except IntegrityError:
+                # Another donation opened the bucket first, which happens to the
+                # all orphanages one at every day rollover under load
+                db.session.execute(update)
+
+
+class IdempotencyKey(db.Model):
+    # Response of a write sent with an 'Idempotency-Key' header, replayed when
+    # the same request is retried instead of running it again
+    key = db.Column(db.String(255), primary_key=True)
+    request_hash = db.Column(db.String(32))
+    status_code = db.Column(db.Integer)
+    response_body = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+
+    @staticmethod
+    def fingerprint(data):
+        return md5(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def lookup(key, ttl):
+        stored = IdempotencyKey.query.get(key)
+        if stored is not None and stored.created_at < datetime.utcnow() - timedelta(seconds=ttl):
+            # Expired but not swept yet, the key can be used again
+            db.session.delete(stored)
+            db.session.flush()
+            return None
+        return stored
+
+    @staticmethod
+    def purge_expired(ttl, chunk_size=1000):
+        # Deletes expired keys a chunk at a time so the sweep never holds long locks
+        cutoff = datetime.utcnow() - timedelta(seconds=ttl)
+        deleted = 0
+        while True:
+            keys = [row.key for row in db.session.query(IdempotencyKey.key)
+                    .filter(IdempotencyKey.created_at < cutoff).limit(chunk_size)]
+            if not keys:
+                return deleted
+            IdempotencyKey.query.filter(IdempotencyKey.key.in_(keys)).delete(synchronize_session=False)
+            db.session.commit()
+            deleted += len(keys)
+
+
+class StoredFile(db.Model):
+    # An uploaded image, stored once under its content hash and shared by
+    # every upload of the same bytes. `path` is relative to UPLOAD_FOLDER.
+    path = db.Column(db.String(255), primary_key=True)
+    digest = db.Column(db.String(64), index=True)
+    size = db.Column(db.Integer)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    @staticmethod
+    def acquire(path, digest, size):
+        # One more reference; atomic UPDATE first so concurrent uploads of the
+        # same image can't lose a count, INSERT the first time
+        table = StoredFile.__table__
+        update = table.update().where(table.c.path == path).values(ref_count=table.c.ref_count + 1)
+        if db.session.execute(update).rowcount:
+            return
+        try:
+            with db.session.begin_nested():
+                db.session.execute(table.insert().values(path=path, digest=digest, size=size, ref_count=1,
+                                                         created_at=datetime.utcnow()))
+        except IntegrityError:
+            # Another upload inserted it first
+            db.session.execute(update)
+
+    @staticmethod
+    def release(path):
+        # One less reference. Returns True when it was the last one and the
+        # blob can go, None when the path isn't a stored file.
+        table = StoredFile.__table__
+        update = table.update().where(table.c.path == path).values(ref_count=table.c.ref_count - 1)
+        if not db.session.execute(update).rowcount:
+            return None
+        deleted = db.session.execute(table.delete().where(table.c.path == path, table.c.ref_count <= 0))
+        return deleted.rowcount > 0
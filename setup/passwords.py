@@ -0,0 +1,113 @@
+from threading import BoundedSemaphore, Lock
+from time import monotonic, sleep
+from werkzeug.exceptions import ServiceUnavailable
+from werkzeug.security import generate_password_hash, check_password_hash
+import os
+import tempfile
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class HasherBusy(ServiceUnavailable):
+    description = 'Too many logins at once, please retry shortly'
+
+
+class PasswordHasher():
+    # Caps the (deliberately slow) password hashing so that a login burst
+    # can't take over every worker. At most `workers` hashes run at once on
+    # the host, whatever the number of gunicorn processes: a hash first takes
+    # one of `workers` lock files in slot_dir (flock, so a crashed process
+    # frees its slot). A request waits up to `timeout` seconds for a slot,
+    # then gets a 503. At most `max_pending` requests of a process wait at once.
+    # Without fcntl (Windows) the slots are only shared by the threads of a process.
+    poll_interval = 0.01
+
+    def __init__(self, app=None):
+        self.method = 'pbkdf2:sha256:260000'
+        self.workers = 2
+        self.max_pending = 16
+        self.timeout = 1.0
+        self.slot_dir = None
+        self._pending = None
+        self._local_slots = None
+        self._pid = None
+        self._lock = Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        method = app.config.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256')
+        iterations = app.config.get('PASSWORD_HASH_ITERATIONS')
+        if method.startswith('pbkdf2') and iterations:
+            method = f'{method}:{iterations}'
+        self.method = method
+        self.workers = app.config.get('PASSWORD_HASH_WORKERS', self.workers)
+        self.max_pending = app.config.get('PASSWORD_HASH_MAX_PENDING', self.max_pending)
+        self.timeout = app.config.get('PASSWORD_HASH_QUEUE_TIMEOUT', self.timeout)
+        self.slot_dir = app.config.get('PASSWORD_HASH_SLOT_DIR') or \
+            os.path.join(tempfile.gettempdir(), 'orph-password-hash')
+        if fcntl is not None:
+            os.makedirs(self.slot_dir, exist_ok=True)
+        self._pid = None
+
+    def _semaphores(self):
+        with self._lock:
+            # Rebuilt in each gunicorn worker after the fork
+            if self._pid != os.getpid():
+                self._pending = BoundedSemaphore(self.workers + self.max_pending)
+                self._local_slots = BoundedSemaphore(self.workers)
+                self._pid = os.getpid()
+            return self._pending, self._local_slots
+
+    def _acquire_slot(self, deadline):
+        # The descriptor of the slot file locked, None if every slot stayed busy
+        while True:
+            for slot in range(self.workers):
+                fd = os.open(os.path.join(self.slot_dir, f'slot-{slot}'), os.O_RDWR | os.O_CREAT, 0o600)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return fd
+                except BlockingIOError:
+                    os.close(fd)
+            if monotonic() >= deadline:
+                return None
+            sleep(self.poll_interval)
+
+    def _run(self, function, *args):
+        deadline = monotonic() + self.timeout
+        pending, local_slots = self._semaphores()
+        if not pending.acquire(timeout=self.timeout):
+            raise HasherBusy()
+        try:
+            if fcntl is None:
+                if not local_slots.acquire(timeout=max(0, deadline - monotonic())):
+                    raise HasherBusy()
+                try:
+                    return function(*args)
+                finally:
+                    local_slots.release()
+            fd = self._acquire_slot(deadline)
+            if fd is None:
+                raise HasherBusy()
+            try:
+                return function(*args)
+            finally:
+                # Closing the descriptor releases the lock
+                os.close(fd)
+        finally:
+            pending.release()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        if not password_hash:
+            return False
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        # The stored hash is "<method>$<salt>$<hash>"
+        return bool(password_hash) and password_hash.split('$', 1)[0] != self.method
@@ -0,0 +1,113 @@
+from sqlalchemy import func
+from datetime import date
+from setup import db
+from setup.models import Donation, OrphanageDonationTotal, UserDonationTotal, DonationDailyTotal
+
+
+def merge_total(totals, key, amount, count, last_donation_time):
+    if key is None:
+        return
+    total = totals.setdefault(key, [0, 0, None])
+    total[0] += amount or 0
+    total[1] += count
+    if total[2] is None or (last_donation_time and last_donation_time > total[2]):
+        total[2] = last_donation_time
+
+
+def add_rows_to_totals(rows):
+    # Applies a batch of inserted donation rows to the rollups with one
+    # increment per orphanage, user and day instead of one per donation
+    orph_totals, user_totals, day_totals = {}, {}, {}
+    for row in rows:
+        time = row['donation_time']
+        merge_total(orph_totals, row['orph_id'], row['amount'], 1, time)
+        merge_total(user_totals, row['user_id'], row['amount'], 1, time)
+        merge_total(day_totals, (time.date(), row['orph_id']), row['amount'], 1, time)
+    for key, (amount, count, time) in orph_totals.items():
+        OrphanageDonationTotal.increment(key, amount, count, time)
+    for key, (amount, count, time) in user_totals.items():
+        UserDonationTotal.increment(key, amount, count, time)
+    for (day, orph_id), (amount, count, time) in day_totals.items():
+        DonationDailyTotal.increment(day, orph_id, amount, count)
+
+
+def donation_chunks(chunk_size):
+    # Yields (first_id, last_id] ranges covering the donation table, so that
+    # each aggregate query only reads one slice of it
+    max_id = db.session.query(func.max(Donation.id)).scalar() or 0
+    for start in range(0, max_id, chunk_size):
+        yield start, start + chunk_size
+
+
+def rebuild_donation_totals(chunk_size=50000):
+    # Recomputes the per orphanage and per user totals from the donations table
+    orph_totals, user_totals = {}, {}
+    for column, totals in [(Donation.orph_id, orph_totals), (Donation.user_id, user_totals)]:
+        for start, end in donation_chunks(chunk_size):
+            rows = db.session.query(column, func.sum(Donation.amount), func.count(Donation.id),
+                                    func.max(Donation.donation_time)) \
+                .filter(Donation.id > start, Donation.id <= end).group_by(column)
+            for row in rows:
+                merge_total(totals, *row)
+    for model, key, totals in [(OrphanageDonationTotal, 'orph_id', orph_totals),
+                               (UserDonationTotal, 'user_id', user_totals)]:
+        db.session.execute(model.__table__.delete())
+        rows = [{key: k, 'total_raised': v[0], 'donation_count': v[1], 'last_donation_time': v[2]}
+                for k, v in totals.items()]
+        for i in range(0, len(rows), chunk_size):
+            db.session.execute(model.__table__.insert(), rows[i:i + chunk_size])
+    db.session.commit()
+    return len(orph_totals), len(user_totals)
+
+
+def rebuild_daily_totals(chunk_size=50000):
+    # Recomputes the per day donation buckets from the donations table
+    buckets = {}
+    day = func.date(Donation.donation_time)
+    for start, end in donation_chunks(chunk_size):
+        rows = db.session.query(day, Donation.orph_id, func.sum(Donation.amount), func.count(Donation.id)) \
+            .filter(Donation.id > start, Donation.id <= end, Donation.donation_time != None) \
+            .group_by(day, Donation.orph_id)
+        for row_day, orph_id, amount, count in rows:
+            # SQLite hands the day back as a string
+            if isinstance(row_day, str):
+                row_day = date.fromisoformat(row_day)
+            keys = [DonationDailyTotal.ALL_ORPHANAGES] + ([orph_id] if orph_id is not None else [])
+            for key in keys:
+                bucket = buckets.setdefault((row_day, key), [0, 0])
+                bucket[0] += amount or 0
+                bucket[1] += count
+    db.session.execute(DonationDailyTotal.__table__.delete())
+    rows = [{'day': k[0], 'orph_id': k[1], 'total': v[0], 'donation_count': v[1]} for k, v in buckets.items()]
+    for i in range(0, len(rows), chunk_size):
+        db.session.execute(DonationDailyTotal.__table__.insert(), rows[i:i + chunk_size])
+    db.session.commit()
+    return len(rows)
+
+
+def donation_series(granularity, start, end, orph_id=DonationDailyTotal.ALL_ORPHANAGES):
+    # Sums the daily buckets between start and end (inclusive) into day, week
+    # (starting on Monday) or month periods, with empty periods set to zero
+    rows = db.session.query(DonationDailyTotal.day, DonationDailyTotal.total, DonationDailyTotal.donation_count) \
+        .filter(DonationDailyTotal.orph_id == orph_id, DonationDailyTotal.day >= start,
+                DonationDailyTotal.day <= end)
+    periods = {}
+    day = start
+    while day <= end:
+        periods.setdefault(period_start(day, granularity), [0, 0])
+        day = date.fromordinal(day.toordinal() + 1)
+    for row_day, total, count in rows:
+        period = periods[period_start(row_day, granularity)]
+        period[0] += total
+        period[1] += count
+    series = [{'period': period.isoformat(), 'total': float(value[0]), 'donation_count': value[1]}
+              for period, value in sorted(periods.items())]
+    return series
+
+
+def period_start(day, granularity):
+    if granularity == 'week':
+        return date.fromordinal(day.toordinal() - day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    return day
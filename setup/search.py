@@ -0,0 +1,107 @@
+from sqlalchemy import event, func, inspect, literal_column, or_, text
+from setup import db
+from setup.models import Orphanage
+import re
+
+# Full-text search over the orphanages. SQLite keeps an FTS5 table with one
+# row per orphanage (rowid = orphanage id), updated by the mapper events below.
+# Postgres indexes an expression of the columns themselves (GIN), so there is
+# nothing to keep in sync. Without either, search falls back to LIKE.
+
+SEARCH_COLUMNS = ['name', 'heading', 'story', 'activities', 'good_work']
+# Column weights of the ranking, name matches count the most
+SQLITE_WEIGHTS = (10.0, 5.0, 1.0, 1.0, 1.0)
+SQLITE_DDL = ("CREATE VIRTUAL TABLE IF NOT EXISTS orphanage_fts USING fts5("
+              "name, heading, story, activities, good_work, tokenize='porter unicode61')")
+# Must stay identical to the ix_orphanage_search index expression
+POSTGRES_VECTOR = ("setweight(to_tsvector('english', coalesce(name, '')), 'A') || "
+                   "setweight(to_tsvector('english', coalesce(heading, '')), 'B') || "
+                   "to_tsvector('english', coalesce(story, '') || ' ' || coalesce(activities, '') || ' ' || "
+                   "coalesce(good_work, ''))")
+
+_words = re.compile(r'\w+', re.UNICODE)
+# engine -> whether the FTS5 table exists, checked once per process
+_fts_tables = {}
+
+
+def search_terms(q):
+    # Keeps the words only, so user input can't inject FTS5/tsquery syntax
+    return _words.findall(q or '')
+
+
+def fts_available(bind):
+    engine = getattr(bind, 'engine', bind)
+    if engine.dialect.name != 'sqlite':
+        return False
+    if engine not in _fts_tables:
+        _fts_tables[engine] = bind.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'orphanage_fts'")).first() is not None
+    return _fts_tables[engine]
+
+
+def search_query(q):
+    # Orphanages matching every word of q, best match first
+    terms = search_terms(q)
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        vector = literal_column('(' + POSTGRES_VECTOR + ')')
+        tsquery = func.plainto_tsquery(literal_column("'english'"), ' '.join(terms))
+        return Orphanage.query.filter(vector.op('@@')(tsquery)) \
+            .order_by(func.ts_rank(vector, tsquery).desc(), Orphanage.id)
+    if fts_available(db.session.connection()):
+        fts = db.table('orphanage_fts', db.column('rowid'))
+        match = ' '.join('"' + term + '"' for term in terms)
+        rank = func.bm25(literal_column('orphanage_fts'), *SQLITE_WEIGHTS)
+        return Orphanage.query.join(fts, fts.c.rowid == Orphanage.id) \
+            .filter(literal_column('orphanage_fts').op('MATCH')(match)).order_by(rank, Orphanage.id)
+    query = Orphanage.query
+    for term in terms:
+        pattern = '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        query = query.filter(or_(*[getattr(Orphanage, column).ilike(pattern, escape='\\')
+                                   for column in SEARCH_COLUMNS]))
+    return query.order_by(Orphanage.id)
+
+
+def index_orphanage(connection, orphanage):
+    connection.execute(text('DELETE FROM orphanage_fts WHERE rowid = :id'), {'id': orphanage.id})
+    connection.execute(text(f"INSERT INTO orphanage_fts (rowid, {', '.join(SEARCH_COLUMNS)}) "
+                            f"VALUES (:id, {', '.join(':' + column for column in SEARCH_COLUMNS)})"),
+                       dict({column: getattr(orphanage, column) for column in SEARCH_COLUMNS}, id=orphanage.id))
+
+
+@event.listens_for(Orphanage, 'after_insert')
+def orphanage_inserted(mapper, connection, target):
+    if fts_available(connection):
+        index_orphanage(connection, target)
+
+
+@event.listens_for(Orphanage, 'after_update')
+def orphanage_updated(mapper, connection, target):
+    state = inspect(target)
+    if fts_available(connection) and any(state.attrs[column].history.has_changes() for column in SEARCH_COLUMNS):
+        index_orphanage(connection, target)
+
+
+@event.listens_for(Orphanage, 'after_delete')
+def orphanage_deleted(mapper, connection, target):
+    if fts_available(connection):
+        connection.execute(text('DELETE FROM orphanage_fts WHERE rowid = :id'), {'id': target.id})
+
+
+def rebuild_search_index(chunk_size=10000):
+    # Refills the FTS5 table (creating it if needed) from the orphanages, a
+    # range of ids per statement. Returns the rows indexed, None when the
+    # database has nothing to rebuild.
+    engine = db.engine
+    if engine.dialect.name != 'sqlite':
+        return None
+    db.session.execute(text(SQLITE_DDL))
+    db.session.execute(text('DELETE FROM orphanage_fts'))
+    _fts_tables[engine] = True
+    max_id = db.session.query(func.max(Orphanage.id)).scalar() or 0
+    columns = ', '.join(SEARCH_COLUMNS)
+    for start in range(0, max_id, chunk_size):
+        db.session.execute(text(f'INSERT INTO orphanage_fts (rowid, {columns}) SELECT id, {columns} FROM orphanage '
+                                'WHERE id > :start AND id <= :end'), {'start': start, 'end': start + chunk_size})
+    db.session.commit()
+    return db.session.execute(text('SELECT count(*) FROM orphanage_fts')).scalar()
@@ -0,0 +1,122 @@
+from datetime import datetime, timedelta
+from setup import db, passwords, response_cache
+from setup.models import User, Orphanage, Message, Donation
+from setup.geo import encode as geohash_encode
+from setup.rollups import rebuild_donation_totals, rebuild_daily_totals
+from setup.search import rebuild_search_index
+import random
+
+# Synthetic data for scale testing. Rows go in through Core executemany in
+# chunks, which is orders of magnitude faster than session.add per object.
+
+CITIES = [
+    ('Nairobi', 'Kenya', -1.2921, 36.8219), ('Mombasa', 'Kenya', -4.0435, 39.6682),
+    ('Lagos', 'Nigeria', 6.5244, 3.3792), ('Abuja', 'Nigeria', 9.0765, 7.3986),
+    ('Accra', 'Ghana', 5.6037, -0.1870), ('Kumasi', 'Ghana', 6.6885, -1.6244),
+    ('Kampala', 'Uganda', 0.3476, 32.5825), ('Dar es Salaam', 'Tanzania', -6.7924, 39.2083),
+    ('Kigali', 'Rwanda', -1.9441, 30.0619), ('Addis Ababa', 'Ethiopia', 9.0300, 38.7400),
+    ('Lusaka', 'Zambia', -15.3875, 28.3228), ('Harare', 'Zimbabwe', -17.8252, 31.0335),
+]
+WORDS = ('children school food water books teachers classroom garden library clinic meals uniforms '
+         'volunteers community football music art shelter family future learning hope').split()
+
+SEED_PASSWORD = 'password'
+# Timestamps are spread over the year before it, so that a seed gives the same rows any day
+SEED_END_DATE = datetime(2026, 1, 1)
+
+
+def sentence(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+
+def insert_chunks(table, rows, chunk_size):
+    # rows is a generator, so only one chunk is held in memory at a time
+    chunk = []
+    count = 0
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            db.session.execute(table.insert(), chunk)
+            count += len(chunk)
+            chunk = []
+    if chunk:
+        db.session.execute(table.insert(), chunk)
+        count += len(chunk)
+    db.session.commit()
+    return count
+
+
+def user_rows(rng, count, start, now, password_hash):
+    for i in range(start, start + count):
+        yield {'username': f'user{i}', 'email': f'user{i}@example.com', 'password_hash': password_hash,
+               'is_admin': i == 0, 'phone_no': f'+254{rng.randint(700000000, 799999999)}',
+               'last_seen': now - timedelta(minutes=rng.randint(0, 60 * 24 * 90)), 'updated_at': now}
+
+
+def orphanage_rows(rng, count, start, now):
+    for i in range(start, start + count):
+        city, country, lat, lng = rng.choice(CITIES)
+        lat, lng = round(lat + rng.uniform(-0.5, 0.5), 6), round(lng + rng.uniform(-0.5, 0.5), 6)
+        yield {'name': f'Orphanage {i}', 'email': f'orphanage{i}@example.com', 'students': rng.randint(5, 500),
+               'phone_no': f'+254{rng.randint(700000000, 799999999)}',
+               'location': {'address': f'{rng.randint(1, 999)} {rng.choice(WORDS).title()} Road, {city}, {country}',
+                            'lat': lat, 'lng': lng},
+               'latitude': lat, 'longitude': lng, 'geohash': geohash_encode(lat, lng),
+               'activities': sentence(rng, 40), 'story': ' '.join(sentence(rng, 20) for _ in range(10)),
+               'money_uses': sentence(rng, 30), 'good_work': sentence(rng, 40),
+               'photos_links': [f'static/images/seed-{i}-{n}.jpg' for n in range(rng.randint(1, 5))],
+               'social_media_links': {'facebook': f'https://facebook.com/orphanage{i}'},
+               'paypal_info': {'email': f'orphanage{i}@example.com'},
+               'acttype': rng.choice(['paypal', 'bank']), 'actId': str(rng.randint(10 ** 9, 10 ** 10)),
+               'country': country, 'heading': sentence(rng, 6), 'monthly_donation': str(rng.randint(100, 5000)),
+               'updated_at': now}
+
+
+def message_rows(rng, count, now):
+    for i in range(count):
+        yield {'first_name': rng.choice(WORDS).title(), 'last_name': rng.choice(WORDS).title(),
+               'email': f'message{i}@example.com', 'phone_no': f'+254{rng.randint(700000000, 799999999)}',
+               'content': sentence(rng, 30), 'creation_datetime': now - timedelta(seconds=rng.randint(0, 86400 * 365))}
+
+
+def donation_rows(rng, count, user_ids, orph_ids, now):
+    for _ in range(count):
+        yield {'amount': rng.randint(100, 100000) / 100, 'user_id': rng.choice(user_ids),
+               'orph_id': rng.choice(orph_ids), 'donation_time': now - timedelta(seconds=rng.randint(0, 86400 * 365))}
+
+
+def seed(users=100, orphanages=100, messages=1000, donations=10000, seed=0, chunk_size=10000, log=None,
+         end_date=SEED_END_DATE):
+    # Same seed and end_date, same data. Timestamps are spread over the year
+    # before end_date. Every user's password is SEED_PASSWORD (hashed once).
+    rng = random.Random(seed)
+    now = end_date
+    log = log or (lambda message: None)
+    # Numbering continues after the existing rows, so seeding twice doesn't hit the unique constraints
+    first_user = (db.session.query(db.func.max(User.id)).scalar() or 0)
+    first_orph = (db.session.query(db.func.max(Orphanage.id)).scalar() or 0)
+    counts = {}
+    counts['users'] = insert_chunks(User.__table__, user_rows(rng, users, first_user, now,
+                                                              passwords.hash(SEED_PASSWORD)), chunk_size)
+    log(f"Inserted {counts['users']} users")
+    counts['orphanages'] = insert_chunks(Orphanage.__table__, orphanage_rows(rng, orphanages, first_orph, now),
+                                         chunk_size)
+    log(f"Inserted {counts['orphanages']} orphanages")
+    # The inserts bypass the search index's mapper events as well
+    if counts['orphanages'] and rebuild_search_index() is not None:
+        log('Rebuilt the search index')
+    counts['messages'] = insert_chunks(Message.__table__, message_rows(rng, messages, now), chunk_size)
+    log(f"Inserted {counts['messages']} messages")
+    user_ids = [id for id, in db.session.query(User.id).order_by(User.id)]
+    orph_ids = [id for id, in db.session.query(Orphanage.id).order_by(Orphanage.id)]
+    if donations and user_ids and orph_ids:
+        counts['donations'] = insert_chunks(Donation.__table__, donation_rows(rng, donations, user_ids, orph_ids, now),
+                                            chunk_size)
+        log(f"Inserted {counts['donations']} donations")
+        # The inserts bypass Donation.add_to_totals
+        rebuild_donation_totals()
+        rebuild_daily_totals()
+        log('Rebuilt the donation totals')
+    # Cached orphanage pages don't list the new rows
+    response_cache.bump('orphanages')
+    return counts
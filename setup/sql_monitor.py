@@ -0,0 +1,87 @@
+from flask import current_app, g, request, has_request_context
+from contextlib import contextmanager
+from collections import Counter
+from sqlalchemy import event
+from time import perf_counter
+import re
+
+# Opt-in (SQL_MONITOR=1): logs statements slower than SLOW_QUERY_MS, with their
+# parameters (unless they may hold secrets) and view, and warns when a request runs the same statement more
+# than N_PLUS_ONE_THRESHOLD times, which usually means a lazy load in a loop.
+
+_literals = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_in_lists = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_spaces = re.compile(r'\s+')
+# Statements whose parameters aren't logged: the user table (password hashes,
+# API tokens, emails) and any token or password column
+_sensitive = re.compile(r'\b(?:FROM|INTO|UPDATE|JOIN)\s+"?user\b|token|password', re.IGNORECASE)
+
+
+def normalize(statement):
+    # Same shape of statement -> same key, whatever the values or IN list lengths
+    statement = _literals.sub('?', statement)
+    statement = _in_lists.sub('(?)', statement)
+    return _spaces.sub(' ', statement).strip()
+
+
+def loggable_parameters(statement, parameters):
+    return '<redacted>' if _sensitive.search(statement) else parameters
+
+
+def init_app(app, engine):
+    slow_query_ms = app.config['SLOW_QUERY_MS']
+    threshold = app.config['N_PLUS_ONE_THRESHOLD']
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def start_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('sql_monitor_start', []).append(perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def check_query(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('sql_monitor_start')
+        if not starts:
+            return
+        elapsed_ms = (perf_counter() - starts.pop()) * 1000
+        view = request.endpoint if has_request_context() else None
+        if elapsed_ms >= slow_query_ms:
+            app.logger.warning('Slow query (%.1f ms) in %s: %s; parameters: %.500r',
+                               elapsed_ms, view, statement, loggable_parameters(statement, parameters))
+        if has_request_context():
+            if 'sql_statements' not in g:
+                g.sql_statements = Counter()
+            g.sql_statements[normalize(statement)] += 1
+
+    @app.after_request
+    def check_repeated_statements(response):
+        for statement, count in g.get('sql_statements', Counter()).items():
+            if count > threshold:
+                app.logger.warning('Possible N+1 in %s: statement ran %d times: %s',
+                                   request.endpoint, count, statement)
+        return response
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+@contextmanager
+def query_budget(max_queries, engine=None):
+    # For the tests: fails when the block runs more than max_queries statements
+    #     with query_budget(3):
+    #         client.get('/api/orphanages')
+    if engine is None:
+        from setup import db
+        engine = db.get_engine(current_app._get_current_object())
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+    if len(statements) > max_queries:
+        raise QueryBudgetExceeded(f'{len(statements)} statements ran, the budget is {max_queries}:\n' +
+                                  '\n'.join(normalize(statement) for statement in statements))
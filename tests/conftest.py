@@ -0,0 +1,38 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+from setup import create_app, db
+
+
+@pytest.fixture
+def app_config():
+    # Overridden by the test modules that need other settings
+    return {}
+
+
+@pytest.fixture
+def app(tmp_path, app_config):
+    class TestConfig(Config):
+        TESTING = True
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + str(tmp_path / 'test.db')
+        UPLOAD_FOLDER = str(tmp_path / 'images')
+        RESPONSE_CACHE_PATH = str(tmp_path / 'response_cache.db')
+        PASSWORD_HASH_SLOT_DIR = str(tmp_path / 'password-slots')
+
+    for name, value in app_config.items():
+        setattr(TestConfig, name, value)
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
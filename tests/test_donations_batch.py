@@ -0,0 +1,51 @@
+import pytest
+from setup.models import Donation
+from setup.seed import seed, SEED_PASSWORD
+
+
+@pytest.fixture
+def admin_headers(app, client):
+    seed(users=2, orphanages=1, messages=0, donations=0)
+    # user0 is the admin
+    token = client.post('/api/tokens', json={'username': 'user0', 'password': SEED_PASSWORD}).json['token']
+    return {'Authorization': 'Bearer ' + token}
+
+
+def test_ndjson_errors_name_the_line(client, admin_headers):
+    body = '\n'.join([
+        '{"username": "user1", "orphanage_name": "Orphanage 0", "amount": 10}',
+        '',
+        '{"username": "user1", "orphanage_name": "Orphanage 0", "amount": }',
+        '{"username": "user1", "amount": 5}',
+        '{"username": "nobody", "orphanage_name": "Orphanage 0", "amount": 5}',
+        '[1, 2]',
+        '{"username": "user1", "orphanage_name": "Orphanage 0", "amount": 20}',
+    ])
+    response = client.post('/api/donations/batch', data=body, content_type='application/x-ndjson',
+                           headers=admin_headers)
+    assert response.status_code == 201
+    assert response.json['inserted'] == 2
+    errors = {error['line']: error for error in response.json['errors']}
+    assert sorted(errors) == [3, 4, 5, 6]
+    assert errors[3]['index'] == 1
+    assert errors[3]['error'].startswith('Invalid JSON: Expecting value')
+    assert errors[4]['error'] == 'Missing required fields: orphanage_name'
+    assert errors[5]['error'] == 'User not found: nobody'
+    assert errors[6]['error'] == 'Must be a JSON object'
+    assert Donation.query.count() == 2
+
+
+def test_json_array_errors_name_the_index(client, admin_headers):
+    response = client.post('/api/donations/batch', headers=admin_headers, json=[
+        {'username': 'user1', 'orphanage_name': 'Orphanage 0', 'amount': 'ten'},
+        {'username': 'user1', 'orphanage_name': 'Orphanage 0', 'amount': 10},
+    ])
+    assert response.status_code == 201
+    assert response.json['errors'] == [{'index': 0, 'error': 'Amount must be a number'}]
+
+
+def test_malformed_json_array(client, admin_headers):
+    response = client.post('/api/donations/batch', data='[{"amount": 1},', content_type='application/json',
+                           headers=admin_headers)
+    assert response.status_code == 400
+    assert response.json['message'].startswith('Body is not valid JSON: ')
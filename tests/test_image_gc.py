@@ -0,0 +1,39 @@
+import os
+import pytest
+from setup import db
+from setup.image_gc import collect_images
+from setup.models import Orphanage
+
+
+def write_image(folder, filename):
+    path = os.path.join(folder, *filename.split('/'))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b'image')
+    # Older than any grace period
+    os.utime(path, (0, 0))
+    return path
+
+
+@pytest.mark.parametrize('dry_run', [True, False])
+def test_collect_images_keeps_referenced_files(app, dry_run):
+    folder = app.config['UPLOAD_FOLDER']
+    kept = {
+        'static/images/ab/cd/relative.png': write_image(folder, 'ab/cd/relative.png'),
+        '/static/images/rooted.png': write_image(folder, 'rooted.png'),
+        'https://example.com/static/images/ef/01/absolute.png': write_image(folder, 'ef/01/absolute.png'),
+        'http://example.com/static/images/certificate.pdf?v=2': write_image(folder, 'certificate.pdf'),
+    }
+    unreferenced = write_image(folder, 'ab/cd/unreferenced.png')
+    links = list(kept)
+    db.session.add(Orphanage(name='Orphanage', email='orphanage@example.com', photos_links=links[:3],
+                             registration_certificate=links[3]))
+    db.session.commit()
+
+    stats = collect_images(folder, grace=3600, dry_run=dry_run)
+
+    assert stats['files'] == 5
+    assert stats['referenced'] == 4
+    assert stats['removed'] == 1
+    assert all(os.path.exists(path) for path in kept.values())
+    assert os.path.exists(unreferenced) == dry_run
@@ -0,0 +1,84 @@
+import logging
+import os
+import time
+import pytest
+from setup.logs import BatchingRotatingFileHandler, CoalescingSMTPHandler, LogPipeline
+
+pytestmark = pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs os.fork')
+
+
+def in_child(check):
+    # Runs check() in a forked child, which exits with 0 if it returns True
+    pid = os.fork()
+    if pid == 0:
+        try:
+            code = 0 if check() else 1
+        except BaseException:
+            code = 2
+        os._exit(code)
+    _, status = os.waitpid(pid, 0)
+    return os.waitstatus_to_exitcode(status)
+
+
+@pytest.fixture
+def pipeline_logger():
+    pipelines = []
+
+    def make(*handlers):
+        pipeline = LogPipeline(list(handlers))
+        logger = logging.getLogger(f'test-logs-{len(pipelines)}-{id(pipeline)}')
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        logger.addHandler(pipeline.start())
+        pipelines.append(pipeline)
+        return logger, pipeline
+
+    yield make
+    for pipeline in pipelines:
+        pipeline.stop()
+
+
+def test_file_handler_flushes_after_fork(tmp_path, pipeline_logger):
+    path = tmp_path / 'app.log'
+    handler = BatchingRotatingFileHandler(str(path), flush_interval=0.5)
+    logger, pipeline = pipeline_logger(handler)
+    # Leaves a flush timer pending at the fork, like 'Microblog startup' does
+    logger.info('master line')
+    # Stopping the listener waits for the queued records to be handled
+    pipeline.listener.stop()
+    pipeline._start_listener()
+    assert handler._timer is not None
+
+    def check():
+        logger.info('child line')
+        time.sleep(1.5)
+        lines = path.read_text().splitlines()
+        # The master's line was written once, before the fork
+        return lines.count('master line') == 1 and 'child line' in lines
+
+    assert in_child(check) == 0
+
+
+def test_mail_handler_starts_over_after_fork(pipeline_logger):
+    handler = CoalescingSMTPHandler(('localhost', 1), 'no-reply@localhost', ['admin@localhost'], 'Failure',
+                                    interval=3600)
+    handler._last_sent = time.monotonic()
+    logger, pipeline = pipeline_logger(handler)
+    logger.error('master error')
+    pipeline.listener.stop()
+    pipeline._start_listener()
+    assert handler._timer is not None and handler._records
+
+    def check():
+        if handler._timer is not None or handler._records:
+            return False
+        logger.error('child error')
+        time.sleep(0.5)
+        # A new timer, in this process, will send the child's error
+        return handler._timer is not None and handler._timer.is_alive() and len(handler._records) == 1
+
+    try:
+        assert in_child(check) == 0
+    finally:
+        handler._timer.cancel()
+        handler._records = []
@@ -0,0 +1,155 @@
+import itertools
+import pytest
+from sqlalchemy import event
+from setup import db
+from setup.models import Orphanage
+from setup.seed import seed
+
+# Every filter combination and sort accepted by /api/orphanages. A students
+# range only goes with the students sort.
+FILTER_SETS = [
+    {}, {'country': 'Kenya'}, {'acttype': 'bank'}, {'country': 'Kenya', 'acttype': 'bank'},
+    {'students_min': 100}, {'students_max': 400}, {'students_min': 100, 'students_max': 400},
+    {'country': 'Kenya', 'students_min': 100}, {'acttype': 'bank', 'students_max': 400},
+    {'country': 'Kenya', 'acttype': 'paypal', 'students_min': 100, 'students_max': 400},
+]
+SORTS = [None, 'id', '-id', 'name', '-name', 'students', '-students']
+COMBINATIONS = [(filters, sort) for filters, sort in itertools.product(FILTER_SETS, SORTS)
+                if sort is None or 'students' in sort or not ({'students_min', 'students_max'} & set(filters))]
+
+
+@pytest.fixture
+def orphanages(app):
+    seed(users=1, orphanages=300, messages=0, donations=0)
+    # Orphanages without a students count sort before or after all the others
+    db.session.execute(db.text('UPDATE orphanage SET students = NULL WHERE id % 7 = 0'))
+    db.session.commit()
+
+
+def page_statements(app, client, args):
+    # The SELECTs of orphanage pages run by one request
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if 'FROM orphanage' in statement and 'LIMIT' in statement:
+            statements.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', capture)
+    try:
+        response = client.get('/api/orphanages', query_string=args)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', capture)
+    assert response.status_code == 200, response.json
+    return response, statements
+
+
+def query_plan(statement, parameters):
+    connection = db.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters)
+        return [row[-1] for row in cursor.fetchall()]
+    finally:
+        connection.close()
+
+
+def assert_indexed(statements, filtered):
+    assert statements
+    for statement, parameters in statements:
+        plan = query_plan(statement, parameters)
+        assert not any('TEMP B-TREE' in step for step in plan), plan
+        if filtered:
+            # A full table scan would read the orphanages the filters leave out
+            assert not any(step.startswith('SCAN orphanage') and 'INDEX' not in step for step in plan), plan
+
+
+@pytest.mark.parametrize('filters, sort', COMBINATIONS)
+def test_pages_use_an_index(app, client, orphanages, filters, sort):
+    args = dict(filters, per_page=5)
+    if sort:
+        args['sort'] = sort
+    # Offset pages
+    for page in (1, 3):
+        response, statements = page_statements(app, client, dict(args, page=page))
+        assert_indexed(statements, bool(filters))
+    # Cursor pages, the first one and one deep in the listing
+    response, statements = page_statements(app, client, dict(args, after=''))
+    assert_indexed(statements, bool(filters))
+    for _ in range(8):
+        cursor = response.json['_meta']['next_cursor']
+        if cursor is None:
+            break
+        response, statements = page_statements(app, client, dict(args, after=cursor))
+        assert_indexed(statements, bool(filters))
+
+
+def expected_ids(filters, sort):
+    rows = Orphanage.query.all()
+    rows = [row for row in rows if all(getattr(row, field) == filters[field]
+                                       for field in ('country', 'acttype') if field in filters)]
+    if 'students_min' in filters:
+        rows = [row for row in rows if row.students is not None and row.students >= filters['students_min']]
+    if 'students_max' in filters:
+        rows = [row for row in rows if row.students is not None and row.students <= filters['students_max']]
+    name = (sort or 'students').lstrip('-') if {'students_min', 'students_max'} & set(filters) else \
+        (sort or 'id').lstrip('-')
+    columns = Orphanage.sort_keys[name]
+    # SQLite sorts NULLs first in ascending order
+    key = lambda row: tuple((getattr(row, column) is not None, getattr(row, column)) for column in columns)
+    rows.sort(key=key, reverse=bool(sort and sort.startswith('-')))
+    return [row.id for row in rows]
+
+
+@pytest.mark.parametrize('filters, sort', COMBINATIONS)
+def test_cursor_pages_list_every_row_once(app, client, orphanages, filters, sort):
+    args = dict(filters, per_page=7, after='', fields='name')
+    if sort:
+        args['sort'] = sort
+    ids = []
+    while True:
+        response = client.get('/api/orphanages', query_string=args)
+        assert response.status_code == 200
+        ids += [item['id'] for item in response.json['items']]
+        if response.json['_meta']['next_cursor'] is None:
+            break
+        args['after'] = response.json['_meta']['next_cursor']
+    assert ids == expected_ids(filters, sort)
+
+
+@pytest.mark.parametrize('sort', ['id', '-id', 'name', '-name'])
+def test_students_range_rejects_other_sorts(client, orphanages, sort):
+    response = client.get('/api/orphanages', query_string={'students_min': 10, 'sort': sort})
+    assert response.status_code == 400
+
+
+def test_students_range_defaults_to_students_order(client, orphanages):
+    response = client.get('/api/orphanages', query_string={'students_min': 100, 'per_page': 50})
+    students = [item['students'] for item in response.json['items']]
+    assert students == sorted(students)
+    assert 'sort=students' in response.json['_links']['self']
+
+
+def test_fields_accepts_id(client, orphanages):
+    response = client.get('/api/orphanages', query_string={'fields': 'id', 'per_page': 5})
+    assert response.status_code == 200
+    assert all(set(item) == {'id', '_links'} for item in response.json['items'])
+
+
+@pytest.mark.parametrize('sort', ['name', '-students'])
+def test_cursor_pages_load_the_sort_columns(app, client, orphanages, sort):
+    # The next cursor is read from the sort columns, even when fields leaves them out
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', capture)
+    try:
+        response = client.get('/api/orphanages', query_string={'fields': 'country', 'sort': sort, 'after': ''})
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', capture)
+    assert response.status_code == 200
+    assert response.json['_meta']['next_cursor'] is not None
+    assert all(set(item) == {'id', 'country', '_links'} for item in response.json['items'])
+    # No lazy load of a deferred column
+    assert not [statement for statement in statements if 'WHERE orphanage.id = ' in statement]
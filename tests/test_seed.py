@@ -0,0 +1,24 @@
+from setup import db
+from setup.models import Donation, Message, User
+from setup.seed import seed, SEED_END_DATE
+
+
+def snapshot():
+    return (
+        [(u.username, u.phone_no, u.last_seen) for u in User.query.order_by(User.id)],
+        [(m.email, m.content, m.creation_datetime) for m in Message.query.order_by(Message.id)],
+        [(d.user_id, d.orph_id, d.amount, d.donation_time) for d in Donation.query.order_by(Donation.id)],
+    )
+
+
+def test_same_seed_same_rows(app):
+    seed(users=5, orphanages=5, messages=20, donations=50, seed=3)
+    first = snapshot()
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+    seed(users=5, orphanages=5, messages=20, donations=50, seed=3)
+    assert snapshot() == first
+    # Nothing depends on the day the data is seeded
+    times = [row[-1] for rows in first for row in rows]
+    assert all(SEED_END_DATE.replace(year=SEED_END_DATE.year - 1) <= time <= SEED_END_DATE for time in times)
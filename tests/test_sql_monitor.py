@@ -0,0 +1,57 @@
+import logging
+import pytest
+from setup import token_cache
+from setup.seed import seed, SEED_PASSWORD
+from setup.sql_monitor import QueryBudgetExceeded, query_budget
+
+
+@pytest.fixture
+def app_config():
+    # Every statement counts as slow, so each one is logged
+    return {'SQL_MONITOR': True, 'SLOW_QUERY_MS': 0}
+
+
+@pytest.fixture
+def admin_headers(app, client):
+    seed(users=3, orphanages=2, messages=0, donations=0)
+    # user0 is the admin
+    token = client.post('/api/tokens', json={'username': 'user0', 'password': SEED_PASSWORD}).json['token']
+    return {'Authorization': 'Bearer ' + token}
+
+
+def add_donations(client, headers, count):
+    response = client.post('/api/donations/batch', headers=headers, json=[
+        {'username': 'user1', 'orphanage_name': 'Orphanage 0', 'amount': 10} for _ in range(count)])
+    assert response.status_code in (200, 201), response.json
+
+
+@pytest.mark.parametrize('donations', [1, 50])
+def test_get_donations_query_budget(client, admin_headers, donations):
+    add_donations(client, admin_headers, donations)
+    client.get('/api/orphanage_donations/1', headers=admin_headers)
+    # The orphanage and one joined query for the donations and their donors,
+    # however many there are (the token is cached after the first request)
+    with query_budget(2):
+        response = client.get('/api/orphanage_donations/1', headers=admin_headers)
+    assert response.status_code == 200
+    assert len(response.json['donations']) == donations
+
+
+def test_query_budget_exceeded(client, admin_headers):
+    with pytest.raises(QueryBudgetExceeded):
+        with query_budget(0):
+            client.get('/api/orphanages')
+
+
+def test_slow_query_log_redacts_secrets(app, client, admin_headers, caplog):
+    token = admin_headers['Authorization'].split()[1]
+    # Empty the token cache, so that the token is looked up in the database
+    token_cache.clear()
+    with caplog.at_level(logging.WARNING, logger=app.logger.name):
+        client.get('/api/orphanage_donations/1', headers=admin_headers)
+        client.put('/api/user/1', json={'password': 'a new password'}, headers=admin_headers)
+    messages = [record.getMessage() for record in caplog.records if 'Slow query' in record.getMessage()]
+    assert any('FROM user' in message and '<redacted>' in message for message in messages)
+    assert not any(token in message or 'pbkdf2' in message for message in messages)
+    # Other statements keep their parameters
+    assert any('FROM orphanage' in message and '(1,' in message for message in messages)